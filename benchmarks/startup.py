@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The results worker only needs its own modules, the import of the module tree is what a spawned process pays.
+MODULES = ['core.url_parse', 'core.url_extract', 'cool_carbine']
+
+
+def time_import(module: str, number: int = 5) -> float:
+    timings = []
+    for _ in range(number):
+        output = subprocess.check_output(
+            [sys.executable, '-c', f'import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)'],
+            cwd=ROOT
+        )
+        timings.append(float(output.decode().strip().splitlines()[-1]))
+
+    return min(timings)
+
+
+def main():
+    for module in MODULES:
+        print(f'import {module}: {time_import(module) * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+import pickle
+import timeit
+from typing import Union
+
+from domain import SessionPairResultsDto, HttpClientResponseDto, SessionPair, KEPT_HEADERS
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'test_data', 'html')
+
+# A typical set of response headers, all of them used to be copied onto the DTO.
+HEADERS = {
+    'Date': 'Sat, 26 Oct 2019 10:00:00 GMT', 'Content-Type': 'text/html; charset=utf-8', 'Content-Length': '286871',
+    'Connection': 'keep-alive', 'Server': 'nginx', 'Cache-Control': 'max-age=60, public', 'Vary': 'Accept-Encoding',
+    'ETag': 'W/"460c7-16e07f"', 'Last-Modified': 'Sat, 26 Oct 2019 09:59:00 GMT', 'X-Frame-Options': 'SAMEORIGIN',
+    'Strict-Transport-Security': 'max-age=31536000', 'X-Content-Type-Options': 'nosniff', 'Age': '12',
+    'Accept-Ranges': 'bytes', 'Via': '1.1 varnish', 'X-Cache': 'HIT', 'X-Cache-Hits': '3',
+    'Content-Security-Policy': "default-src 'self' https: data: 'unsafe-inline' 'unsafe-eval'",
+}
+
+
+def get_results(body: Union[str, bytes], headers) -> SessionPairResultsDto:
+    client_response = HttpClientResponseDto()
+    client_response.status = 200
+    client_response.reason = 'OK'
+    client_response.content_type = 'text/html'
+    client_response.charset = 'utf-8'
+    client_response.headers = headers
+
+    return SessionPairResultsDto(SessionPair(None, 'https://www.aftenbladet.no/'), client_response, body)
+
+
+def pickle_round_trip(body: bytes):
+    # The old path decoded in the HTTP process and pickled the text with every header.
+    results = get_results(body.decode('utf-8'), dict(HEADERS))
+    return pickle.loads(pickle.dumps(results)).response_body
+
+
+def wire_round_trip(body: bytes):
+    results = get_results(body, {name: HEADERS[name] for name in KEPT_HEADERS})
+    return SessionPairResultsDto.from_bytes(results.to_bytes()).response_body
+
+
+def main(number: int = 200):
+    for file_name in sorted(os.listdir(TEST_DATA)):
+        with open(os.path.join(TEST_DATA, file_name), 'rb') as fd:
+            body = fd.read()
+
+        pickle_time = timeit.timeit(lambda: pickle_round_trip(body), number=number) / number
+        wire_time = timeit.timeit(lambda: wire_round_trip(body), number=number) / number
+        pickle_size = len(pickle.dumps(get_results(body.decode('utf-8'), dict(HEADERS))))
+        wire_size = len(get_results(body, {name: HEADERS[name] for name in KEPT_HEADERS}).to_bytes())
+
+        print(f'{file_name}: pickle={pickle_time * 1e6:.0f}us/{pickle_size}B, wire={wire_time * 1e6:.0f}us/{wire_size}B, '
+              f'speedup={pickle_time / wire_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
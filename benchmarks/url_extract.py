@@ -0,0 +1,20 @@
+import os
+import timeit
+
+from core.url_extract import EXTRACTORS
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'test_data', 'html')
+
+
+def main(number: int = 20):
+    for file_name in sorted(os.listdir(TEST_DATA)):
+        with open(os.path.join(TEST_DATA, file_name), 'r') as fd:
+            body = fd.read()
+
+        timings = {name: timeit.timeit(lambda: extractor(body), number=number) / number for name, extractor in EXTRACTORS.items()}
+        print(f'{file_name}: ' + ', '.join(f'{name}={elapsed * 1000:.2f}ms' for name, elapsed in timings.items())
+              + f', speedup={timings["bs4"] / timings["tokenizer"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
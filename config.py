@@ -2,21 +2,75 @@ DATABASE_CONFIG = {
     'user': 'root',
     'password': '123qwe',
     'database': 'cool_carbine',
-    'host': '172.17.0.4'
+    'host': '172.17.0.4',
+    'pool': {
+        'min_size': 2,
+        'max_size': 10,
+        'statement_cache_size': 1024,
+        'max_inactive_connection_lifetime': 300
+    }
 }
 
 MAX_HOURLY_VISITS = 10
 
+QUEUE_CONFIG = {
+    'frontier_size': 500,
+    'batch_size': 300,
+    'lease_timeout': 600,
+    'seen_size': 100000
+}
+
+VISITED_CONFIG = {
+    'enabled': True,
+    'path': 'visited.bloom',
+    'capacity': 50000000,
+    'error_rate': 0.01
+}
+
 RESULTS_CONFIG = {
-    'workers': 1
+    'workers': 1,
+    'concurrency': 8
 }
 
 PARSE_CONFIG = {
-    'core.url_extract': {}
+    'workers': 2,
+    'core.url_extract': {
+        'extractor': 'tokenizer'
+    }
+}
+
+RECRAWL_CONFIG = {
+    'enabled': True,
+    # Seconds between visits of a page, the estimated time between changes is clamped to these.
+    'min_interval': 3600,
+    'max_interval': 30 * 24 * 3600,
+    # Used until a page has been fetched twice.
+    'default_interval': 24 * 3600,
+    # Older checks count half once a page has this many, so the estimate follows pages that change pace.
+    'history': 20
+}
+
+VALIDATOR_CONFIG = {
+    # Send If-None-Match/If-Modified-Since for pages fetched before.
+    'enabled': True,
+    'cache_size': 10000
+}
+
+GIT_PROBE_CONFIG = {
+    # Seconds before a netloc is probed for /.git/HEAD again.
+    'ttl': 30 * 24 * 3600
+}
+
+STORAGE_CONFIG = {
+    'enabled': False,
+    'directory': '/media/puse/disk12/CoolCarabine/',
+    'segment_size': 1024 ** 3,
+    'compression': 'gzip'
 }
 
 RECORDER_CONFIG = {
-    'enable_page_recorder': False
+    'enable_page_recorder': False,
+    'batch_writes': True
 }
 
 HTTP_CONFIG = {
@@ -24,6 +78,43 @@ HTTP_CONFIG = {
     'worker': {
         'name': 'aiohttp',
         'timeout': 15,
+        'connect_timeout': 5,
+        'content_types': ['text/html'],
+        'max_body_size': 5 * 1024 * 1024,
+        'chunk_size': 64 * 1024,
+        'concurrency': 50,
+        # Starting concurrency per netloc, the host health grows or shrinks it between min and max.
+        'netloc_concurrency': 2,
+        'health': {
+            'min_concurrency': 1,
+            'max_concurrency': 4,
+            'target_latency': 2.0,
+            'decrease_factor': 0.5,
+            'failure_statuses': [429, 502, 503, 504],
+            'failure_threshold': 3,
+            'backoff': 60,
+            'max_backoff': 3600,
+            'park_threshold': 10,
+            'park_duration': 86400,
+            'flush_interval': 5,
+            'idle': 3600
+        },
+        'connector': {
+            'limit': 100,
+            'limit_per_host': 4,
+            'keepalive_timeout': 30
+        },
+        'dns': {
+            # None uses the nameservers of the system.
+            'nameservers': None,
+            'timeout': 5,
+            'min_ttl': 60,
+            'max_ttl': 3600,
+            'negative_ttl': 600,
+            'error_ttl': 60,
+            'max_size': 100000,
+            'prefetch_concurrency': 20
+        },
         'headers': {
             'User-Agent': 'Mozilla/5.0 (compatible; CoolCarbine/0.1-dev; +http://www.puse.cat/bot.html)'
         }
@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import logging.config
 import multiprocessing
 import time
@@ -9,13 +10,19 @@ from urllib.parse import urlparse, urlsplit
 
 from structlog import get_logger
 
-from config import HTTP_CONFIG, RESULTS_CONFIG, RECORDER_CONFIG
+from config import HTTP_CONFIG, RESULTS_CONFIG, RECORDER_CONFIG, STORAGE_CONFIG
 from core.cool_carbine_http import http_worker_wrapper
-from core.database import get_connection
+from core.database import acquire, create_pool, close_pool, reset_pool
+from core.git_probe import registry as probe_registry, claim_probes, mark_probed, record_probe_status
+from core.migrations import run_migrations
 from core.page_recorder import record_page_connections
-from core.queue import add_to_queue, queue_worker
-from core.url_extract import extract_urls
+from core.page_validators import save_validators
+from core.recrawl import schedule_recrawl, content_hash
+from core.store import store_page
+from core.queue import add_to_queue, queue_worker, create_frontier, acknowledge_queue_item, queue_urls, utc_now
+from core.url_extract import extract_urls, shutdown_parse_pool
 from core.url_parse import CCUrl
+from core.visited import mark_visited, is_fetched
 from domain import http_consts, SessionPairResultsDto
 
 MAX_HOURLY_VISITS = 20
@@ -100,41 +107,49 @@ structlog.configure(
 
 
 async def record_visit(session_pair_results: SessionPairResultsDto, worker_id: int):
-    if session_pair_results is None or not hasattr(session_pair_results, 'session_pair'):
-        print(session_pair_results)
-
-    connection = await get_connection()
     parsed_url = urlparse(session_pair_results.url)
 
-    await connection.execute(
-        '''insert into visits (netloc, url) values ($1, $2)''',
-        parsed_url.netloc, session_pair_results.url)
-    await connection.close()
+    async with acquire() as connection:
+        await connection.execute(
+            '''insert into visits (netloc, url) values ($1, $2)''',
+            parsed_url.netloc, session_pair_results.url)
+
+    if is_fetched(session_pair_results):
+        mark_visited(session_pair_results.url)
 
 
-async def create_git_urls(extracted_urls: List[CCUrl], worker_id=int) -> List[CCUrl]:
+async def queue_git_urls(extracted_urls: List[CCUrl], worker_id=int):
     try:
         netlocs = dict()
         for url in extracted_urls:
-            if url.urlparse.netloc not in netlocs:
-                netlocs[url.urlparse.netloc] = url.urlparse
+            if url.netloc not in netlocs:
+                netlocs[url.netloc] = url.urlparse
+
+        # Only netlocs that were never probed, or not within the ttl, get a new probe.
+        due = probe_registry.due(netlocs.keys())
+        if not due:
+            return
+
+        now = utc_now()
+        async with acquire() as connection:
+            async with connection.transaction():
+                claimed = await claim_probes(connection, due, now)
 
-        git_urls: List[CCUrl] = []
-        for netloc, url in netlocs.items():
-            url_parts = urlsplit(url.geturl())
-            git_url = CCUrl(url_parts._replace(path='/.git/HEAD').geturl())
-            git_urls.append(git_url)
-            log.info('Creating git url for netloc.', netloc=netloc, results_worker=worker_id)
+                git_urls: List[CCUrl] = []
+                for netloc in claimed:
+                    url_parts = urlsplit(netlocs[netloc].geturl())
+                    git_urls.append(CCUrl(url_parts._replace(path='/.git/HEAD').geturl()))
+                    log.info('Creating git url for netloc.', netloc=netloc, results_worker=worker_id)
 
-        return git_urls + extracted_urls
+                # Queued directly, a re-probe is a URL the seen and visited filters of add_to_queue would drop.
+                await queue_urls(connection, [(git_url, now) for git_url in git_urls])
+
+        mark_probed(due, now)
     except Exception as ex:
         log.exception('Something wen wrong when creating git url for netloc.', results_worker=worker_id)
 
-    return []
-
 
 async def insert_git_response(session_pair_results: SessionPairResultsDto, worker_id: int):
-    connection = await get_connection()
     try:
         status = 'None'
         if session_pair_results.client_response and session_pair_results.client_response.redirected:
@@ -146,26 +161,48 @@ async def insert_git_response(session_pair_results: SessionPairResultsDto, worke
         elif session_pair_results.client_response:
             status = session_pair_results.client_response.status
 
-        await connection.execute(
-            '''insert into git_heads (url, status) values ($1, $2); ''',
-            session_pair_results.url,
-            str(status)
-        )
+        async with acquire() as connection:
+            await connection.execute(
+                '''insert into git_heads (url, status) values ($1, $2); ''',
+                session_pair_results.url,
+                str(status)
+            )
+            await record_probe_status(connection, urlsplit(session_pair_results.url).netloc, str(status))
     except Exception as ex:
         log.exception('Unknown error when creating git response record.', results_worker=worker_id, exception=str(type(ex)), exception_message=str(ex), url=session_pair_results.url)
-    finally:
-        await connection.close()
 
 
 async def handle_response(session_pair_results: SessionPairResultsDto, worker_id: int):
     if session_pair_results.url.endswith('/.git/HEAD'):
         await insert_git_response(session_pair_results, worker_id)
 
-    if session_pair_results.response_body is not None:
-        # TODO Disable this.
-        # await store_page(session_pair_results)
+    response = session_pair_results.client_response
+    if response is not None and response.status == http_consts.StatusCodes.NOT_MODIFIED:
+        # Nothing changed since the last fetch, the links it had are already queued.
+        log.debug('Page not modified.', url=session_pair_results.url, results_worker=worker_id)
+        await save_validators(session_pair_results.url, response.headers, worker_id)
+        await schedule_recrawl(session_pair_results, None, worker_id)
+        return
+
+    if response is not None and response.status == http_consts.StatusCodes.OK and not response.redirected:
+        await save_validators(session_pair_results.url, response.headers, worker_id)
+
+    if session_pair_results.has_body():
+        if STORAGE_CONFIG.get('enabled'):
+            await store_page(session_pair_results, worker_id)
+
         if session_pair_results.client_response.content_type == http_consts.ContentTypes.TEXT_HTML:
-            extracted_urls = await extract_urls(session_pair_results, worker_id)
+            if response.status == http_consts.StatusCodes.OK and not response.redirected:
+                await schedule_recrawl(session_pair_results, content_hash(session_pair_results), worker_id)
+
+            if session_pair_results.extracted_urls is not None:
+                extracted_urls = [CCUrl(url) for url in session_pair_results.extracted_urls]
+            elif session_pair_results.response_body is not None:
+                extracted_urls = await extract_urls(session_pair_results, worker_id)
+            else:
+                log.info('Could not decode response body.', url=session_pair_results.url, results_worker=worker_id)
+                return
+
             t1_start = time.perf_counter()
             if RECORDER_CONFIG.get('enable_page_recorder'):
                 await record_page_connections(extracted_urls, session_pair_results, worker_id)
@@ -175,14 +212,14 @@ async def handle_response(session_pair_results: SessionPairResultsDto, worker_id
             log.debug('record_page_connections perf_counter.', start=t1_start, end=t1_end, elapsed=t1_end - t1_start, url=session_pair_results.url, results_worker=worker_id)
 
             t2_start = time.perf_counter()
-            extracted_urls = await create_git_urls(extracted_urls, worker_id)
+            await queue_git_urls(extracted_urls, worker_id)
             t2_end = time.perf_counter()
-            log.debug('create_git_urls perf_counter.', start=t2_start, end=t2_end, elapsed=t2_end - t2_start, url=session_pair_results.url, results_worker=worker_id)
+            log.debug('queue_git_urls perf_counter.', start=t2_start, end=t2_end, elapsed=t2_end - t2_start, url=session_pair_results.url, results_worker=worker_id)
 
             t3_start = time.perf_counter()
             await add_to_queue(extracted_urls, worker_id)
             t3_end = time.perf_counter()
-            log.debug('add_to_queue perf_counter.', start=t3_start, end=t3_end, elapsed=t3_end - t3_start, urls=len(extracted_urls), per_row=(t3_end - t3_start)/len(extracted_urls), url=session_pair_results.url, results_worker=worker_id)
+            log.debug('add_to_queue perf_counter.', start=t3_start, end=t3_end, elapsed=t3_end - t3_start, urls=len(extracted_urls), per_row=(t3_end - t3_start)/max(len(extracted_urls), 1), url=session_pair_results.url, results_worker=worker_id)
 
         else:
             log.debug('Unhandled content-type', results_worker=worker_id, content_type=session_pair_results.client_response.content_type, url=session_pair_results.url)
@@ -190,33 +227,68 @@ async def handle_response(session_pair_results: SessionPairResultsDto, worker_id
         log.debug('There was no response for this request', session_pair_results=session_pair_results, results_worker=worker_id)
 
 
-async def results_worker(results_queue: 'Queue[SessionPairResultsDto]', worker_id: int):
-    log.info('Results worker starting.', results_worker=worker_id)
+async def results_reader(results_queue: 'Queue[bytes]', pending: 'asyncio.Queue[SessionPairResultsDto]', worker_id: int):
+    """Drain the inter-process queue from an executor thread so the blocking get never stalls the event loop."""
+    loop = asyncio.get_event_loop()
+    get = functools.partial(results_queue.get, timeout=1)
 
     while True:
         try:
-            work = results_queue.get(timeout=1)
-            log.debug(f'results_queue size', size=results_queue.qsize(), results_worker=worker_id)
+            work = await loop.run_in_executor(None, get)
+        except Empty:
+            continue
+
+        log.debug(f'results_queue size', size=results_queue.qsize(), results_worker=worker_id)
+        await pending.put(SessionPairResultsDto.from_bytes(work))
+
 
+async def results_consumer(pending: 'asyncio.Queue[SessionPairResultsDto]', worker_id: int):
+    while True:
+        work = await pending.get()
+        try:
             t1_start = time.perf_counter()
             await record_visit(work, worker_id)
             await handle_response(work, worker_id)
             t1_end = time.perf_counter()
 
             log.debug(f'perf_counter stats', elapsed=t1_end - t1_start, start=t1_start, end=t1_end, url=work.url, results_worker=worker_id)
-
-        except Empty:
-            await asyncio.sleep(10)
         except Exception as ex:
             log.exception('Unknown exception in ResultsWorker.', results_worker=worker_id,  exception=str(type(ex)), exception_message=str(ex))
+        finally:
+            # Acknowledged even when handling failed, a result that fails every time would otherwise be fetched again
+            # each time its lease runs out.
+            try:
+                await acknowledge_queue_item(work.url)
+            except Exception as ex:
+                log.exception('Could not acknowledge queue item.', results_worker=worker_id, exception=str(type(ex)), exception_message=str(ex), url=work.url)
+            pending.task_done()
 
 
-def results_worker_wrapper(results_queue: 'Queue[SessionPairResultsDto]', worker_id: int):
+async def results_worker(results_queue: 'Queue[bytes]', worker_id: int):
+    log.info('Results worker starting.', results_worker=worker_id)
+    await create_pool()
+
+    concurrency = RESULTS_CONFIG.get('concurrency', 1)
+    pending: 'asyncio.Queue[SessionPairResultsDto]' = asyncio.Queue(maxsize=concurrency * 2)
+    consumers = [results_consumer(pending, worker_id) for _ in range(concurrency)]
+
+    try:
+        await asyncio.gather(results_reader(results_queue, pending, worker_id), *consumers)
+    finally:
+        await close_pool()
+
+
+def results_worker_wrapper(results_queue: 'Queue[bytes]', worker_id: int):
+    reset_pool()
     asyncio.run(results_worker(results_queue, worker_id))
 
 
 async def start_workers(loop):
-    queue = Queue()
+    await run_migrations()
+    # Forked results processes must not inherit the pool, it is created again on first use after the fork.
+    await close_pool()
+
+    queue = create_frontier()
     results_queue = multiprocessing.Queue()
 
     workers = [http_worker_wrapper(queue, results_queue, x) for x in range(HTTP_CONFIG.get('workers', 10))]
@@ -225,7 +297,11 @@ async def start_workers(loop):
     for x in range(RESULTS_CONFIG.get('workers', 12)):
         Process(target=results_worker_wrapper, args=(results_queue, x)).start()
 
-    await asyncio.gather(*workers)
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        shutdown_parse_pool()
+        await close_pool()
 
 
 async def main(loop):
@@ -2,24 +2,34 @@ import asyncio
 import socket
 import ssl
 import time
-from queue import Queue, Empty
+from queue import Queue
+from typing import Union, Set, List
+from urllib.parse import urlparse
 
 import aiohttp
-from aiohttp import AsyncResolver
 from structlog import get_logger
 
+from core.database import acquire
+from core.dns import get_resolver
+from core.host_health import get_host_health
+from core.page_validators import validator_cache
+from core.queue import defer_queue_items, park_netlocs
+from core.url_extract import get_parse_pool, extract_url_list
 from domain import SessionPair, HttpClientResponseDto, SessionPairResultsDto
+from domain.http_consts import ContentTypes, StatusCodes
 from config import HTTP_CONFIG
 
 log = get_logger()
 
 
 class AioHTTPWorker:
-    def __init__(self, queue: 'Queue[str]', results_queue: 'Queue[SessionPairResultsDto]', config, worker_id: int):
+    def __init__(self, queue: 'asyncio.Queue[str]', results_queue: 'Queue[bytes]', config, worker_id: int):
         self._queue = queue
         self._results_queue = results_queue
         self._worker_id = worker_id
         self._config = config
+        self._session: Union[aiohttp.ClientSession, None] = None
+        self._tasks: Set[asyncio.Task] = set()
         self._set_config()
 
     def _set_config(self):
@@ -27,10 +37,42 @@ class AioHTTPWorker:
         self._headers = self._config.get('headers', {
             'User-Agent': 'Mozilla/5.0 (compatible; CoolCarbine/0.1-dev; +http://www.puse.cat/bot.html)'
         })
-        self._resolver = AsyncResolver(nameservers=self._config.get('nameservers', ['1.1.1.1', '8.8.8.8']))
+        self._connect_timeout = self._config.get('connect_timeout', 5)
+        self._resolver = get_resolver(self._config.get('dns'))
+        self._connector_config = self._config.get('connector', {})
+        self._content_types = self._config.get('content_types', ['text/html'])
+        self._max_body_size = self._config.get('max_body_size', 5 * 1024 * 1024)
+        self._chunk_size = self._config.get('chunk_size', 64 * 1024)
+        self._concurrency = self._config.get('concurrency', 1)
+        self._health_config = self._config.get('health', {})
+        self._health = get_host_health(self._health_config, self._config.get('netloc_concurrency', 2))
+        self._failure_statuses = set(self._health_config.get('failure_statuses', [429, 502, 503, 504]))
+
+    def create_connector(self) -> aiohttp.TCPConnector:
+        return aiohttp.TCPConnector(
+            resolver=self._resolver,
+            family=socket.AF_INET,
+            ssl=False,
+            limit=self._connector_config.get('limit', 100),
+            limit_per_host=self._connector_config.get('limit_per_host', 4),
+            # The shared resolver caches by record ttl, the connector cache would only hold on to stale answers.
+            use_dns_cache=False,
+            keepalive_timeout=self._connector_config.get('keepalive_timeout', 30)
+        )
 
     def create_session(self):
-        return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self._timeout), headers=self._headers, connector=aiohttp.TCPConnector(resolver=self._resolver, family=socket.AF_INET, ssl=False))
+        return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self._timeout, sock_connect=self._connect_timeout), headers=self._headers, connector=self.create_connector())
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = self.create_session()
+
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     def get_log_info(self):
         return {'http_worker_name': self.__class__.__name__, 'http_worker_id': self._worker_id}
@@ -39,9 +81,35 @@ class AioHTTPWorker:
         log.info('Fetching URL.', url=session_pair.url, **self.get_log_info())
         t1_start = time.perf_counter()
         try:
-            async with session_pair.session.get(session_pair.url) as response:
-                log.info('Finished fetching URL.', url=session_pair.url, **self.get_log_info())
-                return SessionPairResultsDto(session_pair, HttpClientResponseDto(response), await response.text())
+            async with session_pair.session.get(session_pair.url, headers=validator_cache.take_headers(session_pair.url)) as response:
+                client_response = HttpClientResponseDto(response)
+
+                if response.status == StatusCodes.NOT_MODIFIED:
+                    log.info('Page not modified.', url=session_pair.url, **self.get_log_info())
+                    return SessionPairResultsDto(session_pair, client_response, None)
+
+                # Leaving the context without reading the body closes the connection, so the body of a
+                # skipped response is never downloaded.
+                if response.content_type not in self._content_types:
+                    log.info('Skipping body of unhandled content-type.', url=session_pair.url, content_type=response.content_type, **self.get_log_info())
+                    return SessionPairResultsDto(session_pair, client_response, None)
+
+                if response.content_length is not None and response.content_length > self._max_body_size:
+                    log.info('Skipping body larger than max body size.', url=session_pair.url, content_length=response.content_length, max_body_size=self._max_body_size, **self.get_log_info())
+                    return SessionPairResultsDto(session_pair, client_response, None)
+
+                body = await self.read_body(response)
+                if body is None:
+                    log.info('Aborted reading body larger than max body size.', url=session_pair.url, max_body_size=self._max_body_size, **self.get_log_info())
+                    return SessionPairResultsDto(session_pair, client_response, None)
+
+                log.info('Finished fetching URL.', url=session_pair.url, size=len(body), **self.get_log_info())
+                return SessionPairResultsDto(session_pair, client_response, body)
+        except (aiohttp.ClientConnectorCertificateError, aiohttp.ClientConnectorSSLError) as ex:
+            log.info('SSL error when connecting.', exception_message=str(ex), url=session_pair.url, **self.get_log_info())
+        except aiohttp.ClientConnectorError as ex:
+            self._resolver.mark_unreachable(ex.host, reason=str(ex))
+            log.info('Could not connect to host.', exception_message=str(ex), url=session_pair.url, **self.get_log_info())
         except ssl.SSLError as ex:
             log.exception('Unknown SSL error when fetching url.', exception=str(type(ex)), exception_message=str(ex), url=session_pair.url, **self.get_log_info())
         except TimeoutError:
@@ -53,44 +121,148 @@ class AioHTTPWorker:
         finally:
             t1_end = time.perf_counter()
             log.debug('Fetching URL perf_counter.', start=t1_start, end=t1_end, elapsed=t1_end - t1_start, url=session_pair.url, **self.get_log_info())
-            await session_pair.session.close()
 
         return SessionPairResultsDto(session_pair, None, None)
 
+    async def read_body(self, response: aiohttp.ClientResponse) -> Union[bytes, None]:
+        """Read the body in chunks, returns None as soon as it grows past the max body size."""
+        chunks: List[bytes] = []
+        size = 0
+        async for chunk in response.content.iter_chunked(self._chunk_size):
+            size += len(chunk)
+            if size > self._max_body_size:
+                return None
+            chunks.append(chunk)
+
+        return b''.join(chunks)
+
     def get_session_pair(self, url: str) -> SessionPair:
-        return SessionPair(self.create_session(), url)
+        return SessionPair(self.get_session(), url)
 
     async def http_worker(self, url: str) -> SessionPairResultsDto:
         session_pair = self.get_session_pair(url)
         return await self.fetch_url(session_pair)
 
-    async def start(self):
+    def record_health(self, netloc: str, result: SessionPairResultsDto, latency: float):
+        response = result.client_response
+        if response is None or response.status in self._failure_statuses:
+            self._health.record_failure(netloc)
+        else:
+            self._health.record_success(netloc, latency)
+
+    async def flush_health(self):
+        """Hand the URLs of open circuits back to the queue and park the rows of hosts that keep failing."""
+        deferred = self._health.take_deferred()
+        parked = self._health.take_parked()
+        if deferred or parked:
+            async with acquire() as connection:
+                await defer_queue_items(connection, deferred)
+                await park_netlocs(connection, parked)
+
+        for netloc, duration in parked:
+            log.info('Parked netloc after consecutive failures.', netloc=netloc, duration=duration, **self.get_log_info())
+        self._health.prune(self._health_config.get('idle', 3600))
+
+    async def health_flusher(self):
+        interval = self._health_config.get('flush_interval', 5)
         while True:
+            await asyncio.sleep(interval)
             try:
-                work = self._queue.get(timeout=1)
-                result = await self.http_worker(work)
-                self._results_queue.put(result)
-                self._queue.task_done()
-                await results_catch_up_waiter(self._results_queue, self._worker_id, type(AioHTTPWorker).__name__)
-            except Empty:
-                await asyncio.sleep(5)
+                await self.flush_health()
             except Exception as ex:
-                log.exception('Unknown exception in http handler', exception=str(type(ex)), exception_message=str(ex), **self.get_log_info())
-                raise ex
+                log.exception('Unknown exception when flushing host health.', exception=str(type(ex)), exception_message=str(ex), **self.get_log_info())
+
+    async def extract_urls(self, result: SessionPairResultsDto):
+        """Parse HTML in the parse process pool, the results workers fall back to parsing when this is skipped."""
+        parse_pool = get_parse_pool()
+        if parse_pool is None or result.response_bytes is None or result.client_response.content_type != ContentTypes.TEXT_HTML:
+            return
+
+        t1_start = time.perf_counter()
+        try:
+            result.extracted_urls = await asyncio.get_event_loop().run_in_executor(
+                parse_pool, extract_url_list, result.url, result.response_bytes, result.client_response.charset
+            )
+        except UnicodeDecodeError:
+            log.info('Unicode decode error.', url=result.url, **self.get_log_info())
+        except Exception as ex:
+            log.exception('Unknown exception when extracting URLs.', exception=str(type(ex)), exception_message=str(ex), url=result.url, **self.get_log_info())
+        t1_end = time.perf_counter()
+        log.debug('Extracting URLs perf_counter.', start=t1_start, end=t1_end, elapsed=t1_end - t1_start, url=result.url, **self.get_log_info())
+
+    async def process(self, url: str, semaphore: asyncio.Semaphore):
+        netloc = urlparse(url).netloc
+        try:
+            result = None
+            if not self._health.is_open(netloc):
+                await self._health.acquire(netloc)
+                try:
+                    # The circuit may have opened while this URL waited for its turn.
+                    if not self._health.is_open(netloc):
+                        t1_start = time.perf_counter()
+                        result = await self.http_worker(url)
+                        self.record_health(netloc, result, time.perf_counter() - t1_start)
+                finally:
+                    await self._health.release(netloc)
+
+            if result is None:
+                log.info('Circuit open for netloc, deferring URL.', url=url, netloc=netloc, **self.get_log_info())
+                self._health.defer(url, netloc)
+            else:
+                await self.extract_urls(result)
+                self._results_queue.put(result.to_bytes())
+            self._queue.task_done()
+        except Exception as ex:
+            log.exception('Unknown exception in http handler', exception=str(type(ex)), exception_message=str(ex), url=url, **self.get_log_info())
+        finally:
+            semaphore.release()
+
+    async def start(self):
+        # Bounds the number of fetches this worker has in flight, the per netloc limits of the host health
+        # keep a single host from taking all of them.
+        semaphore = asyncio.Semaphore(self._concurrency)
+        flusher = asyncio.ensure_future(self.health_flusher())
+
+        try:
+            while True:
+                try:
+                    await semaphore.acquire()
+                    try:
+                        work = await self._queue.get()
+                    except BaseException:
+                        semaphore.release()
+                        raise
+
+                    task = asyncio.ensure_future(self.process(work, semaphore))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+                    await results_catch_up_waiter(self._results_queue, self._worker_id, type(AioHTTPWorker).__name__)
+                except Exception as ex:
+                    log.exception('Unknown exception in http handler', exception=str(type(ex)), exception_message=str(ex), **self.get_log_info())
+                    raise ex
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            flusher.cancel()
+            await self.flush_health()
 
 
-async def results_catch_up_waiter(results_queue: 'Queue[SessionPairResultsDto]', worker_id: int, http_worker_name: str):
+async def results_catch_up_waiter(results_queue: 'Queue[bytes]', worker_id: int, http_worker_name: str):
     while results_queue.qsize() > 100:
         log.info('Waiting for results queue to catch up.', queue_size=results_queue.qsize(), http_worker_id=worker_id, http_worker_name=http_worker_name)
         await asyncio.sleep(5)
 
 
-async def start_aiohttp_module(queue: 'Queue[str]', results_queue: 'Queue[SessionPairResultsDto]', config, worker_id: int):
+async def start_aiohttp_module(queue: 'asyncio.Queue[str]', results_queue: 'Queue[bytes]', config, worker_id: int):
     worker = AioHTTPWorker(queue, results_queue, config, worker_id)
-    await worker.start()
+    try:
+        await worker.start()
+    finally:
+        await worker.close()
 
 
-async def http_worker_wrapper(queue: 'Queue[str]', results_queue: 'Queue[SessionPairResultsDto]', worker_id: int):
+async def http_worker_wrapper(queue: 'asyncio.Queue[str]', results_queue: 'Queue[bytes]', worker_id: int):
     log.info('Starting HTTP worker.', http_worker=worker_id)
     await asyncio.sleep(10)
     http_module = HTTP_CONFIG.get('worker')
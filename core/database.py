@@ -1,10 +1,59 @@
+from contextlib import asynccontextmanager
+from typing import Union
+
 import asyncpg
+from asyncpg.pool import Pool
 
 from config import DATABASE_CONFIG
 
+_pool: Union[Pool, None] = None
+
+
+def get_connection_config() -> dict:
+    return {k: v for k, v in DATABASE_CONFIG.items() if k != 'pool'}
+
 
 async def get_connection():
     # return await asyncpg.connect(user='root', password='123qwe',
     #                             database='cool_carbine', host='172.17.0.3')
 
-    return await asyncpg.connect(**DATABASE_CONFIG)
+    return await asyncpg.connect(**get_connection_config())
+
+
+async def create_pool() -> Pool:
+    global _pool
+
+    if _pool is None:
+        pool_config = DATABASE_CONFIG.get('pool', {})
+        _pool = await asyncpg.create_pool(
+            min_size=pool_config.get('min_size', 2),
+            max_size=pool_config.get('max_size', 10),
+            statement_cache_size=pool_config.get('statement_cache_size', 1024),
+            max_inactive_connection_lifetime=pool_config.get('max_inactive_connection_lifetime', 300),
+            **get_connection_config()
+        )
+
+    return _pool
+
+
+async def close_pool():
+    global _pool
+
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def reset_pool():
+    """Forget a pool inherited over fork without closing it, its connections belong to the parent."""
+    global _pool
+
+    _pool = None
+
+
+@asynccontextmanager
+async def acquire():
+    """Acquire a connection from the per-process pool, creating the pool on first use."""
+    pool = await create_pool()
+    async with pool.acquire() as connection:
+        yield connection
@@ -0,0 +1,192 @@
+import asyncio
+import socket
+import time
+from collections import OrderedDict
+from typing import Union, List, Dict, Tuple, Iterable, Any, Set
+from urllib.parse import urlsplit
+
+from aiohttp.abc import AbstractResolver
+from structlog import get_logger
+
+log = get_logger()
+
+# aiodns error codes for names that do not exist or have no address, these are cached for the negative ttl.
+_NOT_FOUND_ERRORS = (1, 4)
+
+
+class DnsEntry:
+    __slots__ = ('addresses', 'expires', 'error')
+
+    def __init__(self, addresses: List[str], expires: float, error: Union[str, None] = None):
+        self.addresses = addresses
+        self.expires = expires
+        self.error = error
+
+
+class CachingResolver(AbstractResolver):
+    """Process wide DNS cache in front of aiodns."""
+
+    def __init__(self, nameservers: Union[List[str], None] = None, timeout: float = 5, min_ttl: float = 60,
+                 max_ttl: float = 3600, negative_ttl: float = 600, error_ttl: float = 60, max_size: int = 100000,
+                 prefetch_concurrency: int = 20):
+        self._nameservers = nameservers
+        self._timeout = timeout
+        self._min_ttl = min_ttl
+        self._max_ttl = max_ttl
+        self._negative_ttl = negative_ttl
+        self._error_ttl = error_ttl
+        self._max_size = max_size
+        self._prefetch_concurrency = prefetch_concurrency
+        self._cache: 'OrderedDict[Tuple[str, int], DnsEntry]' = OrderedDict()
+        self._pending: Dict[Tuple[str, int], asyncio.Future] = dict()
+        self._prefetching: Set[Tuple[str, int]] = set()
+        self._prefetch_semaphore: Union[asyncio.Semaphore, None] = None
+        self._resolver = None
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _get_resolver(self):
+        if self._resolver is None:
+            import aiodns
+            self._resolver = aiodns.DNSResolver(nameservers=self._nameservers, timeout=self._timeout)
+
+        return self._resolver
+
+    async def _query(self, host: str, family: int) -> Tuple[List[str], float]:
+        """Look a host up, returns the addresses and the lowest ttl of the answer."""
+        records = await self._get_resolver().query(host, 'AAAA' if family == socket.AF_INET6 else 'A')
+        return [record.host for record in records], min((record.ttl for record in records), default=0)
+
+    def _store(self, key: Tuple[str, int], entry: DnsEntry):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+
+    def _get_entry(self, key: Tuple[str, int], now: float) -> Union[DnsEntry, None]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+
+        if entry.expires <= now:
+            del self._cache[key]
+            return None
+
+        return entry
+
+    async def _lookup(self, key: Tuple[str, int]) -> DnsEntry:
+        host, family = key
+        try:
+            addresses, ttl = await self._query(host, family)
+            if addresses:
+                entry = DnsEntry(addresses, time.monotonic() + min(max(ttl, self._min_ttl), self._max_ttl))
+            else:
+                entry = DnsEntry([], time.monotonic() + self._negative_ttl, 'No addresses found.')
+        except Exception as ex:
+            code = ex.args[0] if ex.args else None
+            message = str(ex.args[1]) if len(ex.args) > 1 else 'DNS lookup failed'
+            # Names that do not exist are kept for the negative ttl, transient errors only for the error ttl.
+            ttl = self._negative_ttl if code in _NOT_FOUND_ERRORS else self._error_ttl
+            entry = DnsEntry([], time.monotonic() + ttl, message)
+
+        self._store(key, entry)
+        return entry
+
+    async def lookup(self, host: str, family: int = socket.AF_INET) -> DnsEntry:
+        key = (host, family)
+        entry = self._get_entry(key, time.monotonic())
+        if entry is not None:
+            self._cache.move_to_end(key)
+            return entry
+
+        # Concurrent lookups of the same host share a single query.
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._lookup(key))
+            self._pending[key] = future
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+
+        return await asyncio.shield(future)
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict[str, Any]]:
+        entry = await self.lookup(host, family)
+        if entry.error is not None:
+            raise OSError(entry.error)
+
+        return [{
+            'hostname': host,
+            'host': address,
+            'port': port,
+            'family': family,
+            'proto': 0,
+            'flags': socket.AI_NUMERICHOST | socket.AI_NUMERICSERV
+        } for address in entry.addresses]
+
+    def mark_unreachable(self, host: str, family: int = socket.AF_INET, reason: str = 'Host unreachable.'):
+        """Fail lookups of a host that could not be connected to for the negative ttl."""
+        entry = self._get_entry((host, family), time.monotonic())
+        if entry is not None and entry.error is not None:
+            # Already failing, connecting again is refused by the entry itself so it is not extended.
+            return
+
+        self._store((host, family), DnsEntry([], time.monotonic() + self._negative_ttl, reason))
+
+    def prefetch(self, hosts: Iterable[str], family: int = socket.AF_INET):
+        """Start lookups for hosts that are not cached, past prefetch_concurrency they wait for a free slot."""
+        if self._prefetch_semaphore is None:
+            self._prefetch_semaphore = asyncio.Semaphore(self._prefetch_concurrency)
+
+        now = time.monotonic()
+        for host in set(hosts):
+            key = (host, family)
+            if not host or key in self._prefetching or key in self._pending or self._get_entry(key, now) is not None:
+                continue
+
+            self._prefetching.add(key)
+            future = asyncio.ensure_future(self._prefetch(key))
+            future.add_done_callback(self._prefetch_done)
+
+    async def _prefetch(self, key: Tuple[str, int]):
+        try:
+            async with self._prefetch_semaphore:
+                await self.lookup(*key)
+        finally:
+            self._prefetching.discard(key)
+
+    def _prefetch_done(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            log.debug('DNS prefetch failed.', exception=str(future.exception()))
+
+    async def close(self):
+        pass
+
+
+_resolver: Union[CachingResolver, None] = None
+
+
+def get_resolver(config: Union[Dict[str, Any], None] = None) -> CachingResolver:
+    global _resolver
+
+    if _resolver is None:
+        config = config or {}
+        _resolver = CachingResolver(
+            nameservers=config.get('nameservers'),
+            timeout=config.get('timeout', 5),
+            min_ttl=config.get('min_ttl', 60),
+            max_ttl=config.get('max_ttl', 3600),
+            negative_ttl=config.get('negative_ttl', 600),
+            error_ttl=config.get('error_ttl', 60),
+            max_size=config.get('max_size', 100000),
+            prefetch_concurrency=config.get('prefetch_concurrency', 20)
+        )
+
+    return _resolver
+
+
+def prefetch_urls(urls: Iterable[str]):
+    """Warm the cache for the hosts of URLs about to be fetched, a no-op until an HTTP worker created the resolver."""
+    if _resolver is None:
+        return
+
+    _resolver.prefetch(urlsplit(url).hostname for url in urls)
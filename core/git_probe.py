@@ -0,0 +1,100 @@
+import datetime
+from typing import Union, Dict, List, Iterable
+
+from asyncpg import Record
+from structlog import get_logger
+
+from config import GIT_PROBE_CONFIG
+
+log = get_logger()
+
+STATUS_QUEUED = 'queued'
+
+
+def utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class ProbeRegistry:
+    """When each netloc was last probed for /.git/HEAD."""
+
+    def __init__(self, ttl: datetime.timedelta):
+        self._ttl = ttl
+        self._probed: Dict[str, datetime.datetime] = dict()
+
+    def __len__(self):
+        return len(self._probed)
+
+    @property
+    def ttl(self) -> datetime.timedelta:
+        return self._ttl
+
+    def known(self, netloc: str) -> bool:
+        return netloc in self._probed
+
+    def load(self, netloc: str, probed: datetime.datetime):
+        current = self._probed.get(netloc)
+        if current is None or probed > current:
+            self._probed[netloc] = probed
+
+    def is_due(self, netloc: str, now: Union[datetime.datetime, None] = None) -> bool:
+        probed = self._probed.get(netloc)
+        return probed is None or probed + self._ttl <= (now or utc_now())
+
+    def due(self, netlocs: Iterable[str], now: Union[datetime.datetime, None] = None) -> List[str]:
+        now = now or utc_now()
+        return [netloc for netloc in netlocs if self.is_due(netloc, now)]
+
+
+registry = ProbeRegistry(datetime.timedelta(seconds=GIT_PROBE_CONFIG.get('ttl', 30 * 24 * 3600)))
+
+
+async def load_probes(connection, netlocs: List[str]):
+    unknown = [netloc for netloc in netlocs if not registry.known(netloc)]
+    if not unknown:
+        return
+
+    values: List[Record] = await connection.fetch(
+        '''select netloc, probed from netloc_probes where netloc = any($1::varchar[])''',
+        unknown
+    )
+    for value in values:
+        registry.load(value.get('netloc'), value.get('probed'))
+
+
+async def claim_probes(connection, netlocs: List[str], now: datetime.datetime) -> List[str]:
+    """Return the netlocs that should be probed now, run it in the transaction that queues the probes."""
+    netlocs = registry.due(netlocs, now)
+    if not netlocs:
+        return []
+
+    await load_probes(connection, netlocs)
+    netlocs = registry.due(netlocs, now)
+    if not netlocs:
+        return []
+
+    # Only rows whose probe is older than the ttl are touched, so processes racing on a netloc claim it once.
+    values: List[Record] = await connection.fetch(
+        '''insert into netloc_probes (netloc, status, probed)
+           select netloc, $2, $3 from unnest($1::varchar[]) as v (netloc)
+           on conflict (netloc) do update set status = excluded.status, probed = excluded.probed
+           where netloc_probes.probed <= excluded.probed - $4 * interval '1 second'
+           returning netloc''',
+        netlocs, STATUS_QUEUED, now, registry.ttl.total_seconds()
+    )
+
+    return [value.get('netloc') for value in values]
+
+
+def mark_probed(netlocs: List[str], now: datetime.datetime):
+    """Remember the netlocs once the claim is committed, the ones another process claimed count as probed too."""
+    for netloc in netlocs:
+        registry.load(netloc, now)
+
+
+async def record_probe_status(connection, netloc: str, status: str):
+    await connection.execute(
+        '''insert into netloc_probes (netloc, status, probed) values ($1, $2, $3)
+           on conflict (netloc) do update set status = excluded.status''',
+        netloc, status, utc_now()
+    )
@@ -0,0 +1,164 @@
+import asyncio
+import time
+from typing import Union, Dict, List, Tuple
+
+
+class HostState:
+    __slots__ = ('limit', 'in_flight', 'failures', 'open_until', 'latency', 'last_decrease', 'last_seen', 'condition')
+
+    def __init__(self, limit: float, now: float):
+        self.limit = limit
+        self.in_flight = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.latency: Union[float, None] = None
+        self.last_decrease = 0.0
+        self.last_seen = now
+        self.condition: Union[asyncio.Condition, None] = None
+
+
+class HostHealth:
+    """Per netloc circuit breaker and AIMD concurrency limit for the fetcher."""
+
+    def __init__(self, initial_concurrency: int = 2, min_concurrency: int = 1, max_concurrency: int = 4,
+                 target_latency: float = 2.0, decrease_factor: float = 0.5, failure_threshold: int = 3,
+                 backoff: float = 60, max_backoff: float = 3600, park_threshold: int = 10, park_duration: float = 86400):
+        self._initial_concurrency = initial_concurrency
+        self._min_concurrency = min_concurrency
+        self._max_concurrency = max_concurrency
+        self._target_latency = target_latency
+        self._decrease_factor = decrease_factor
+        self._failure_threshold = failure_threshold
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._park_threshold = park_threshold
+        self._park_duration = park_duration
+        self._states: Dict[str, HostState] = dict()
+        self._deferred: List[Tuple[str, float]] = []
+        self._parked: List[Tuple[str, float]] = []
+
+    def __len__(self):
+        return len(self._states)
+
+    def get_state(self, netloc: str, now: Union[float, None] = None) -> HostState:
+        now = now or time.monotonic()
+        state = self._states.get(netloc)
+        if state is None:
+            state = HostState(float(self._initial_concurrency), now)
+            self._states[netloc] = state
+
+        state.last_seen = now
+        return state
+
+    def limit(self, netloc: str) -> int:
+        state = self.get_state(netloc)
+        if state.failures >= self._failure_threshold:
+            # Half open, a single request finds out if the host is back.
+            return 1
+
+        return max(self._min_concurrency, int(state.limit))
+
+    def is_open(self, netloc: str, now: Union[float, None] = None) -> bool:
+        state = self._states.get(netloc)
+        return state is not None and state.open_until > (now or time.monotonic())
+
+    def open_until(self, netloc: str) -> float:
+        return self.get_state(netloc).open_until
+
+    def _decrease(self, state: HostState, now: float):
+        if now - state.last_decrease < (state.latency or 0):
+            return
+
+        state.limit = max(float(self._min_concurrency), state.limit * self._decrease_factor)
+        state.last_decrease = now
+
+    def record_success(self, netloc: str, latency: float, now: Union[float, None] = None):
+        now = now or time.monotonic()
+        state = self.get_state(netloc, now)
+        state.failures = 0
+        state.open_until = 0.0
+        state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+
+        if state.latency > self._target_latency:
+            self._decrease(state, now)
+        else:
+            state.limit = min(float(self._max_concurrency), state.limit + 1 / max(state.limit, 1))
+
+    def record_failure(self, netloc: str, now: Union[float, None] = None):
+        now = now or time.monotonic()
+        state = self.get_state(netloc, now)
+        state.failures += 1
+        self._decrease(state, now)
+
+        # The circuit opens at the threshold and the backoff doubles with every failure after it.
+        if state.failures >= self._failure_threshold:
+            backoff = min(self._max_backoff, self._backoff * 2 ** (state.failures - self._failure_threshold))
+            state.open_until = now + backoff
+
+        if state.failures == self._park_threshold:
+            self._parked.append((netloc, self._park_duration))
+
+    def defer(self, url: str, netloc: str, now: Union[float, None] = None):
+        """Hand a URL of an open circuit back to the queue for when the circuit is half open again."""
+        now = now or time.monotonic()
+        self._deferred.append((url, max(self.open_until(netloc) - now, 0)))
+
+    def take_deferred(self) -> List[Tuple[str, float]]:
+        deferred = self._deferred
+        self._deferred = []
+        return deferred
+
+    def take_parked(self) -> List[Tuple[str, float]]:
+        parked = self._parked
+        self._parked = []
+        return parked
+
+    async def acquire(self, netloc: str):
+        state = self.get_state(netloc)
+        if state.condition is None:
+            state.condition = asyncio.Condition()
+
+        async with state.condition:
+            await state.condition.wait_for(lambda: state.in_flight < self.limit(netloc))
+            state.in_flight += 1
+
+    async def release(self, netloc: str):
+        state = self.get_state(netloc)
+        state.in_flight -= 1
+        async with state.condition:
+            # The limit may have grown as well, so wake every waiter to check it.
+            state.condition.notify_all()
+
+    def prune(self, idle: float, now: Union[float, None] = None):
+        """Forget netlocs nothing was fetched from for idle seconds and whose circuit is not open."""
+        now = now or time.monotonic()
+        idle_netlocs = [
+            netloc for netloc, state in self._states.items()
+            if state.in_flight == 0 and state.open_until <= now and now - state.last_seen > idle
+        ]
+        for netloc in idle_netlocs:
+            del self._states[netloc]
+
+
+_host_health: Union[HostHealth, None] = None
+
+
+def get_host_health(config: Union[Dict, None] = None, initial_concurrency: int = 2) -> HostHealth:
+    global _host_health
+
+    if _host_health is None:
+        config = config or {}
+        _host_health = HostHealth(
+            initial_concurrency=initial_concurrency,
+            min_concurrency=config.get('min_concurrency', 1),
+            max_concurrency=config.get('max_concurrency', 4),
+            target_latency=config.get('target_latency', 2.0),
+            decrease_factor=config.get('decrease_factor', 0.5),
+            failure_threshold=config.get('failure_threshold', 3),
+            backoff=config.get('backoff', 60),
+            max_backoff=config.get('max_backoff', 3600),
+            park_threshold=config.get('park_threshold', 10),
+            park_duration=config.get('park_duration', 86400)
+        )
+
+    return _host_health
@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+import os
+from typing import List, Tuple, Set
+
+from structlog import get_logger
+
+from core.database import acquire, close_pool
+
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'domain', 'migrations')
+# Advisory lock key held while migrating.
+MIGRATIONS_LOCK = 201910260000
+
+log = get_logger()
+
+
+def list_migrations(directory: str = MIGRATIONS_DIRECTORY) -> List[Tuple[str, str]]:
+    """Return (name, sql) for every migration file, ordered by the timestamp prefix of the name."""
+    migrations: List[Tuple[str, str]] = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith('.sql'):
+            continue
+
+        with open(os.path.join(directory, file_name), 'r') as fd:
+            migrations.append((file_name[:-len('.sql')], fd.read()))
+
+    return migrations
+
+
+def migration_version(sql: str) -> str:
+    return hashlib.sha256(sql.encode()).hexdigest()
+
+
+async def get_applied_migrations(connection) -> Set[str]:
+    values = await connection.fetch('''select name from migrations;''')
+    return {value.get('name') for value in values}
+
+
+async def run_migrations(directory: str = MIGRATIONS_DIRECTORY) -> List[str]:
+    """Apply the migrations that are not recorded in the migrations table, each in its own transaction."""
+    applied: List[str] = []
+
+    async with acquire() as connection:
+        # Nodes starting together wait for each other, the applied set is read once the lock is held.
+        await connection.execute('''select pg_advisory_lock($1);''', MIGRATIONS_LOCK)
+        try:
+            done = await get_applied_migrations(connection)
+
+            for name, sql in list_migrations(directory):
+                if name in done:
+                    continue
+
+                log.info('Applying migration.', migration=name)
+                async with connection.transaction():
+                    await connection.execute(sql)
+                    await connection.execute(
+                        '''insert into migrations (name, version) values ($1, $2);''',
+                        name,
+                        migration_version(sql)
+                    )
+                applied.append(name)
+        finally:
+            await connection.execute('''select pg_advisory_unlock($1);''', MIGRATIONS_LOCK)
+
+    return applied
+
+
+async def main():
+    try:
+        await run_migrations()
+    finally:
+        await close_pool()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,9 +1,10 @@
-from typing import List, Union
+from typing import List, Union, Dict, Tuple
 from urllib.parse import urlparse, ParseResult
 
 from structlog import get_logger
 
-from core.database import get_connection
+from config import RECORDER_CONFIG
+from core.database import acquire
 from core.url_parse import CCUrl
 from domain import SessionPairResultsDto
 
@@ -12,43 +13,41 @@ log = get_logger()
 
 
 async def get_page_record(url: str, netloc: str, worker_id: int) -> Union[int, None]:
-    connection = await get_connection()
-
     try:
-        found = await connection.fetchrow(
-            '''select id from page where netloc = $1 and url = $2;''',
-            netloc,
-            url
-        )
-
-        return found.get('id', None) if found else None
+        async with acquire() as connection:
+            found = await connection.fetchrow(
+                '''select id from page where md5(url) = md5($2) and url = $2 and netloc = $1;''',
+                netloc,
+                url
+            )
+
+            return found.get('id', None) if found else None
     except Exception as ex:
         pass # log.exception('Unknown exception when fetching page record.', results_worker=worker_id, exception=ex)
-    finally:
-        await connection.close()
 
     return None
 
 
 async def create_page_record(url: str, netloc: str, worker_id: int, connection=None) -> Union[int, None]:
-    transaction = connection is not None
-
-    if not transaction:
-        connection = await get_connection()
+    if connection is None:
+        async with acquire() as connection:
+            return await create_page_record(url, netloc, worker_id, connection)
 
     try:
-        page_id = (await connection.fetchrow(
+        found = await connection.fetchrow(
             '''insert into page (netloc, url) values ($1, $2) on conflict do nothing returning id;''',
             netloc,
             url
-        )).get('id')
+        )
+        if found is None:
+            found = await connection.fetchrow(
+                '''select id from page where md5(url) = md5($1) and url = $1;''',
+                url
+            )
 
-        return page_id
+        return found.get('id')
     except Exception as ex:
         pass # log.exception('Unknown exception when creating page record.', results_worker=worker_id, exception=ex)
-    finally:
-        if not transaction:
-            await connection.close()
 
     return None
 
@@ -64,24 +63,69 @@ async def create_page_connection(connection, found_on_page: int, extracted_page_
         pass # log.exception('Unknown exception when creating page x page record.', results_worker=worker_id, exception=ex)
 
 
+async def upsert_page_records(connection, pages: List[Tuple[str, str]]) -> Dict[str, int]:
+    """Create any missing (netloc, url) pages and return the id of every page keyed by url."""
+    pages = sorted(set(pages), key=lambda page: page[1])
+    netlocs = [netloc for netloc, _ in pages]
+    urls = [url for _, url in pages]
+
+    # Sorted so consumers inserting the same links wait on each other in one order instead of deadlocking.
+    await connection.execute(
+        '''insert into page (netloc, url)
+           select * from unnest($1::varchar[], $2::varchar[])
+           on conflict (md5(url)) do nothing;''',
+        netlocs,
+        urls
+    )
+    # A separate statement, so pages another consumer committed while the insert waited are seen as well.
+    values = await connection.fetch(
+        '''select p.id, p.url from page p
+           join unnest($1::varchar[]) as v (url) on md5(p.url) = md5(v.url) and p.url = v.url;''',
+        urls
+    )
+
+    return {value.get('url'): value.get('id') for value in values}
+
+
+async def record_page_connections_batched(extracted_urls: List[CCUrl], session_pair_results: SessionPairResultsDto, worker_id: int):
+    parsed_url: ParseResult = urlparse(session_pair_results.url)
+    pages = [(parsed_url.netloc, session_pair_results.url)] + [(url.netloc, url.url) for url in extracted_urls]
+
+    try:
+        async with acquire() as connection:
+            async with connection.transaction():
+                page_ids = await upsert_page_records(connection, pages)
+                page_id = page_ids[session_pair_results.url]
+
+                await connection.copy_records_to_table(
+                    'page_x_page',
+                    records=[(page_id, page_ids[url.url]) for url in extracted_urls],
+                    columns=['found_on_page_id', 'page_id']
+                )
+    except Exception as ex:
+        log.exception('Unknown exception when recording page connections.', results_worker=worker_id, exception=str(type(ex)), exception_message=str(ex), url=session_pair_results.url)
+
+
 async def record_page_connections(extracted_urls: List[CCUrl], session_pair_results: SessionPairResultsDto, worker_id: int):
+    if RECORDER_CONFIG.get('batch_writes', True):
+        await record_page_connections_batched(extracted_urls, session_pair_results, worker_id)
+        return
+
     parsed_url: ParseResult = urlparse(session_pair_results.url)
     page_id = await get_page_record(session_pair_results.url, parsed_url.netloc, worker_id)
 
     if not page_id:
         page_id = await create_page_record(session_pair_results.url, parsed_url.netloc, worker_id)
 
-    connection = await get_connection()
-    tr = connection.transaction()
-    try:
-        await tr.start()
-        for url in extracted_urls:
-            extracted_page_id = await create_page_record(url.url, url.urlparse.netloc, worker_id, connection)
-            await create_page_connection(connection, page_id, extracted_page_id, worker_id)
-    except Exception as ex:
-        await tr.rollback()
-        pass # log.exception('Unknown exception when creating page connection.', results_worker=worker_id, exception=ex)
-    else:
-        await tr.commit()
-    finally:
-        await connection.close()
+    async with acquire() as connection:
+        tr = connection.transaction()
+        try:
+            await tr.start()
+            for url in extracted_urls:
+                extracted_page_id = await create_page_record(url.url, url.netloc, worker_id, connection)
+                await create_page_connection(connection, page_id, extracted_page_id, worker_id)
+        except Exception as ex:
+            await tr.rollback()
+            pass # log.exception('Unknown exception when creating page connection.', results_worker=worker_id, exception=ex)
+        else:
+            await tr.commit()
@@ -0,0 +1,88 @@
+import datetime
+from collections import OrderedDict
+from typing import Union, Dict, List, Tuple
+
+from asyncpg import Record
+from structlog import get_logger
+
+from config import VALIDATOR_CONFIG
+from core.database import acquire
+
+log = get_logger()
+
+
+class ValidatorCache:
+    """ETag and Last-Modified of the URLs waiting in the frontier."""
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._validators: 'OrderedDict[str, Tuple[Union[str, None], Union[str, None]]]' = OrderedDict()
+
+    def __len__(self):
+        return len(self._validators)
+
+    def put(self, url: str, etag: Union[str, None], last_modified: Union[str, None]):
+        self._validators[url] = (etag, last_modified)
+        self._validators.move_to_end(url)
+        while len(self._validators) > self._max_size:
+            self._validators.popitem(last=False)
+
+    def take(self, url: str) -> Tuple[Union[str, None], Union[str, None]]:
+        return self._validators.pop(url, (None, None))
+
+    def take_headers(self, url: str) -> Dict[str, str]:
+        """Conditional request headers for the URL, empty when it has no validators."""
+        etag, last_modified = self.take(url)
+        headers: Dict[str, str] = dict()
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        return headers
+
+
+validator_cache = ValidatorCache(VALIDATOR_CONFIG.get('cache_size', 10000))
+
+
+async def load_validators(urls: List[str]):
+    if not VALIDATOR_CONFIG.get('enabled', False) or not urls:
+        return
+
+    try:
+        async with acquire() as connection:
+            values: List[Record] = await connection.fetch(
+                '''select p.url, p.etag, p.last_modified
+                   from unnest($1::varchar[]) as v (url)
+                   join page_validators p on md5(p.url) = md5(v.url) and p.url = v.url''',
+                urls
+            )
+    except Exception as ex:
+        # Without validators the pages are simply fetched in full.
+        log.exception('Unknown error when loading page validators.', exception=str(type(ex)), exception_message=str(ex))
+        return
+
+    for value in values:
+        validator_cache.put(value.get('url'), value.get('etag'), value.get('last_modified'))
+
+
+async def save_validators(url: str, headers: Union[Dict[str, str], None], worker_id: int):
+    """Remember the validators a response came with, responses without any are not stored."""
+    if not VALIDATOR_CONFIG.get('enabled', False) or not headers:
+        return
+
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    if etag is None and last_modified is None:
+        return
+
+    try:
+        async with acquire() as connection:
+            await connection.execute(
+                '''insert into page_validators (url, etag, last_modified, updated) values ($1, $2, $3, $4)
+                   on conflict (md5(url)) do update set
+                       etag = excluded.etag, last_modified = excluded.last_modified, updated = excluded.updated''',
+                url, etag, last_modified, datetime.datetime.now(datetime.timezone.utc)
+            )
+    except Exception as ex:
+        log.exception('Unknown error when saving page validators.', results_worker=worker_id, exception=str(type(ex)), exception_message=str(ex), url=url)
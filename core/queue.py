@@ -1,173 +1,399 @@
 import asyncio
 import datetime
-import random
+import heapq
+import itertools
 import time
-from queue import Queue
+from collections import OrderedDict
 from typing import Union, List, Dict, Tuple
 
 from asyncpg import Record
 from structlog import get_logger
 
 import config
-from core.database import get_connection
-from core.url_parse import CCUrl
+from core.database import acquire
+from core.dns import prefetch_urls
+from core.page_validators import load_validators
+from core.url_parse import CCUrl, canonicalize_urls
+from core.visited import filter_visited
 from domain import QueueObject
 
 MAX_HOURLY_VISITS = config.MAX_HOURLY_VISITS
 log = get_logger()
 
 
-async def get_next_queue_items() -> List[str]:
-    connection = await get_connection()
+def utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class NetlocState:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens: Union[float, None], updated: datetime.datetime):
+        # None until a URL of the netloc is handed out, the bucket starts full.
+        self.tokens = tokens
+        self.updated = updated
+
+
+class HostScheduler:
+    """Politeness state per netloc, loaded from netloc_schedule for each batch."""
+
+    def __init__(self, max_hourly_visits: int = MAX_HOURLY_VISITS, spacing: datetime.timedelta = datetime.timedelta(minutes=6)):
+        self._max_hourly_visits = max_hourly_visits
+        self._refill_rate = max_hourly_visits / 3600.0
+        self._spacing = spacing
+        self._states: Dict[str, NetlocState] = dict()
+        self._heap: List[Tuple[datetime.datetime, int, QueueObject]] = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def spacing(self) -> datetime.timedelta:
+        return self._spacing
+
+    def load(self, netloc: str, tokens: Union[float, None], updated: datetime.datetime):
+        self._states[netloc] = NetlocState(tokens, updated)
+
+    def _get_state(self, netloc: str, now: datetime.datetime) -> NetlocState:
+        state = self._states.get(netloc)
+        if state is None:
+            state = NetlocState(None, now)
+            self._states[netloc] = state
+
+        return state
+
+    # Enqueueing reserves slots in netloc_schedule, these are the count slots ending at the reserved next_slot.
+    def slots(self, next_slot: datetime.datetime, count: int) -> List[datetime.datetime]:
+        return [next_slot - (count - x) * self._spacing for x in range(count)]
+
+    def _refill(self, state: NetlocState, now: datetime.datetime):
+        if state.tokens is None:
+            state.tokens = float(self._max_hourly_visits)
+        else:
+            elapsed = max((now - state.updated).total_seconds(), 0)
+            state.tokens = min(float(self._max_hourly_visits), state.tokens + elapsed * self._refill_rate)
+        state.updated = now
+
+    def try_acquire(self, netloc: str, now: Union[datetime.datetime, None] = None) -> Union[datetime.datetime, None]:
+        """Take a visit token for the netloc, returns None when granted or the time the next token is available."""
+        now = now or utc_now()
+        state = self._get_state(netloc, now)
+        self._refill(state, now)
+
+        if state.tokens >= 1:
+            state.tokens -= 1
+            return None
+
+        return now + datetime.timedelta(seconds=(1 - state.tokens) / self._refill_rate)
+
+    def push(self, item: QueueObject, due: datetime.datetime):
+        heapq.heappush(self._heap, (due, next(self._counter), item))
+
+    def pop_ready(self, limit: int, now: Union[datetime.datetime, None] = None) -> Tuple[List[QueueObject], List[Tuple[QueueObject, datetime.datetime]]]:
+        """Pop due items, returns the ones that got a token and the deferred ones with the time of their next token."""
+        now = now or utc_now()
+        ready: List[QueueObject] = []
+        deferred: List[Tuple[QueueObject, datetime.datetime]] = []
+        deferred_counts: Dict[str, int] = dict()
+
+        while self._heap and self._heap[0][0] <= now and len(ready) < limit:
+            _, _, item = heapq.heappop(self._heap)
+            available = self.try_acquire(item.netloc, now)
+            if available is None:
+                ready.append(item)
+            else:
+                # Spread the deferred items of a netloc over the following tokens instead of waking them all at once.
+                count = deferred_counts.get(item.netloc, 0)
+                deferred_counts[item.netloc] = count + 1
+                deferred.append((item, available + datetime.timedelta(seconds=count / self._refill_rate)))
+
+        return ready, deferred
+
+    def take_states(self) -> List[Tuple[str, NetlocState]]:
+        # The table is the shared state, nothing is kept between batches.
+        states = list(self._states.items())
+        self._states = dict()
+
+        return states
+
+
+scheduler = HostScheduler()
+
+
+class SeenSet:
+    """Bounded set of recently queued URLs, the least recently seen URL is evicted first."""
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._urls: 'OrderedDict[str, None]' = OrderedDict()
+
+    def __len__(self):
+        return len(self._urls)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._urls
+
+    def filter(self, urls: List[CCUrl]) -> List[CCUrl]:
+        """Return the URLs not seen before, the ones that were get refreshed."""
+        unseen: List[CCUrl] = []
+        for url in urls:
+            if url.url in self._urls:
+                self._urls.move_to_end(url.url)
+            else:
+                unseen.append(url)
+
+        return unseen
+
+    def add(self, urls: List[CCUrl]):
+        for url in urls:
+            self._urls[url.url] = None
+            self._urls.move_to_end(url.url)
+
+        while len(self._urls) > self._max_size:
+            self._urls.popitem(last=False)
+
+
+seen_urls = SeenSet(config.QUEUE_CONFIG.get('seen_size', 100000))
+
+
+async def reserve_netloc_slots(connection, netlocs: List[str]) -> Dict[str, List[datetime.datetime]]:
+    """Reserve a slot per entry of netlocs, the upsert makes every process and node share the slots of a netloc."""
+    counts: Dict[str, int] = dict()
+    for netloc in netlocs:
+        counts[netloc] = counts.get(netloc, 0) + 1
+    # Rows are locked in netloc order, the same order lock_netloc_schedules takes them in.
+    ordered = sorted(counts)
+
     values: List[Record] = await connection.fetch(
-        '''select * from queue where scheduled < CURRENT_TIMESTAMP order by scheduled desc limit 300''')
+        '''insert into netloc_schedule (netloc, next_slot, updated)
+           select netloc, CURRENT_TIMESTAMP + slots * $3 * interval '1 second', CURRENT_TIMESTAMP
+           from unnest($1::varchar[], $2::int[]) as v (netloc, slots)
+           on conflict (netloc) do update set
+               next_slot = greatest(netloc_schedule.next_slot, CURRENT_TIMESTAMP) + (excluded.next_slot - CURRENT_TIMESTAMP)
+           returning netloc, next_slot''',
+        ordered,
+        [counts[netloc] for netloc in ordered],
+        scheduler.spacing.total_seconds()
+    )
+
+    return {
+        value.get('netloc'): scheduler.slots(value.get('next_slot'), counts[value.get('netloc')])
+        for value in values
+    }
+
 
-    netlocs = dict()
-    queue: List[QueueObject] = []
+async def lock_netloc_schedules(connection, netlocs: List[str]):
+    """Lock the token buckets of the netlocs for the rest of the transaction and load them into the scheduler."""
+    netlocs = sorted(set(netlocs))
+    if not netlocs:
+        return
+
+    await connection.execute(
+        '''insert into netloc_schedule (netloc, next_slot, updated)
+           select netloc, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP from unnest($1::varchar[]) as v (netloc)
+           on conflict do nothing''',
+        netlocs
+    )
+    values: List[Record] = await connection.fetch(
+        '''select netloc, tokens, updated from netloc_schedule
+           where netloc = any($1::varchar[])
+           order by netloc
+           for update''',
+        netlocs
+    )
     for value in values:
-        q = QueueObject(**dict(value))
-        netlocs[q.netloc] = True
-        queue.append(q)
-
-    hour_ago = datetime.datetime.now() - datetime.timedelta(hours=1)
-    visits: List[Record] = await connection.fetch(
-        '''select netloc, count(netloc) from visits where time_stamp > $1 and netloc = any($2::varchar[]) group by netloc''',
-        hour_ago, list(netlocs.keys()))
-
-    visits_map = dict()
-    for visit in visits:
-        visits_map[visit.get('netloc')] = visit.get('count')
-
-    # Filter out excessive request to a single netloc
-    filtered_ids: List[int] = []
-    filtered_queue: List[QueueObject] = []
-    queue_map = dict()
-    for item in queue:
-        if item.netloc in queue_map:
-            queue_map[item.netloc] += 1
-        else:
-            queue_map[item.netloc] = 1
+        scheduler.load(value.get('netloc'), value.get('tokens'), value.get('updated'))
 
-        if visits_map.get(item.netloc, 0) + queue_map[item.netloc] < MAX_HOURLY_VISITS:
-            filtered_queue.append(item)
-        else:
-            filtered_ids.append(item.id)
-            log.info('Request to netloc blocked due to reaching max hourly visits.', limit=MAX_HOURLY_VISITS, netloc=item.netloc)
 
-    hour_from_now = datetime.datetime.now() + datetime.timedelta(hours=1)
-    await connection.execute('''UPDATE queue SET scheduled = $1 WHERE id = any($2::int[])''', hour_from_now, filtered_ids)
+async def save_netloc_schedules(connection):
+    states = scheduler.take_states()
+    if not states:
+        return
 
-    ids = [item.id for item in filtered_queue]
+    await connection.execute(
+        '''update netloc_schedule set tokens = v.tokens, updated = v.updated
+           from unnest($1::varchar[], $2::real[], $3::timestamptz[]) as v (netloc, tokens, updated)
+           where netloc_schedule.netloc = v.netloc''',
+        [netloc for netloc, _ in states],
+        [state.tokens for _, state in states],
+        [state.updated for _, state in states]
+    )
 
-    # delete the ones we are crawling.
-    await connection.execute('''delete from queue where id = any($1::int[])''', ids)
 
-    await connection.close()
-    return [item.url for item in filtered_queue]
+async def claim_queue_items(connection, limit: int, lease_timeout: float) -> List[QueueObject]:
+    """Lease up to limit due rows, rows whose lease ran out are handed out again."""
+    # skip locked lets several crawler nodes claim concurrently without getting the same rows.
+    values: List[Record] = await connection.fetch(
+        '''with claimed as (
+               select id from queue
+               where scheduled < CURRENT_TIMESTAMP
+                 and (leased_until is null or leased_until < CURRENT_TIMESTAMP)
+               order by scheduled desc
+               limit $1
+               for update skip locked
+           )
+           update queue set leased_until = CURRENT_TIMESTAMP + $2 * interval '1 second'
+           from claimed
+           where queue.id = claimed.id
+           returning queue.*''',
+        limit, lease_timeout)
+
+    return [QueueObject(**dict(value)) for value in values]
+
+
+async def get_next_queue_items(limit: int = 300) -> List[str]:
+    lease_timeout = config.QUEUE_CONFIG.get('lease_timeout', 600)
+
+    async with acquire() as connection:
+        async with connection.transaction():
+            claimed = await claim_queue_items(connection, limit, lease_timeout)
+
+            netlocs: List[str] = []
+            # The rows are due by the database clock, make sure none of them stay behind in the heap due to clock skew.
+            now = utc_now()
+            for q in claimed:
+                netlocs.append(q.netloc)
+                now = max(now, q.scheduled)
+                scheduler.push(q, q.scheduled)
+
+            await lock_netloc_schedules(connection, netlocs)
+            ready, deferred = scheduler.pop_ready(limit, now)
+            await save_netloc_schedules(connection)
+
+            for item, _ in deferred:
+                log.info('Request to netloc deferred due to reaching max hourly visits.', limit=MAX_HOURLY_VISITS, netloc=item.netloc)
+
+            # Deferred rows go back to the queue, the ready ones keep their lease until acknowledged.
+            await connection.execute(
+                '''update queue set scheduled = v.scheduled, leased_until = null
+                   from unnest($1::int[], $2::timestamptz[]) as v (id, scheduled)
+                   where queue.id = v.id''',
+                [item.id for item, _ in deferred],
+                [available for _, available in deferred]
+            )
+
+        return [item.url for item in ready]
+
+
+async def acknowledge_queue_item(url: str):
+    """Remove a leased row once its result has been handled, unacknowledged rows are retried when the lease runs out."""
+    async with acquire() as connection:
+        await connection.execute(
+            '''delete from queue where md5(url) = md5($1) and url = $1 and leased_until is not null;''',
+            url
+        )
 
 
-async def check_if_queued(url: str) -> bool:
-    connection = await get_connection()
+async def defer_queue_items(connection, url_delays: List[Tuple[str, float]]):
+    """Release leased rows without fetching them, each is scheduled again after its delay in seconds."""
+    if not url_delays:
+        return
 
-    try:
+    await connection.execute(
+        '''update queue set scheduled = CURRENT_TIMESTAMP + v.delay * interval '1 second', leased_until = null
+           from unnest($1::varchar[], $2::float8[]) as v (url, delay)
+           where md5(queue.url) = md5(v.url) and queue.url = v.url''',
+        [url for url, _ in url_delays],
+        [delay for _, delay in url_delays]
+    )
+
+
+async def park_netlocs(connection, netloc_durations: List[Tuple[str, float]]):
+    """Push every unleased row of the netlocs duration seconds into the future."""
+    if not netloc_durations:
+        return
+
+    await connection.execute(
+        '''update queue set scheduled = greatest(queue.scheduled, CURRENT_TIMESTAMP + v.duration * interval '1 second')
+           from unnest($1::varchar[], $2::float8[]) as v (netloc, duration)
+           where queue.netloc = v.netloc and queue.leased_until is null''',
+        [netloc for netloc, _ in netloc_durations],
+        [duration for _, duration in netloc_durations]
+    )
+
+
+async def check_if_queued(url: str) -> bool:
+    async with acquire() as connection:
         value = await connection.fetchrow(
-            '''select id from queue where url = $1;''',
+            '''select id from queue where md5(url) = md5($1) and url = $1;''',
             url
         )
 
         return value is not None
-    finally:
-        await connection.close()
 
 
 async def queue_url(connection, url: CCUrl, scheduled_time: datetime.datetime):
     await connection.execute(
         '''insert into queue (url, netloc, scheduled) values ($1, $2, $3) on conflict do nothing;''',
-        url.url, url.urlparse.netloc, scheduled_time
+        url.url, url.netloc, scheduled_time
     )
 
 
-async def get_netloc_schedules(urls: List[CCUrl], worker_id: int) -> Dict[str, datetime.datetime]:
-    connection = await get_connection()
+async def queue_urls(connection, url_schedule: List[Tuple[CCUrl, datetime.datetime]]):
+    """Queue a batch of URLs in a single round trip by unnesting parallel arrays."""
+    if not url_schedule:
+        return
 
-    try:
-        netlocs = [url.urlparse.netloc for url in urls]
-        log.debug('getting netloc schedule', length=len(netlocs), results_worker=worker_id)
-
-        t1_start = time.perf_counter()
-        values = await connection.fetch(
-            '''select distinct on(netloc) netloc, scheduled from queue where netloc = any($1::varchar[]) order by netloc, scheduled desc;''',
-            netlocs
-        )
-        t1_end = time.perf_counter()
-        log.debug('netloc query time', elapsed=t1_end-t1_start, results_worker=worker_id)
-        latest_schedule: Dict[str, datetime] = dict()
-        for v in values:
-            latest_schedule[v.get('netloc')] = v.get('scheduled')
-
-        return latest_schedule
-    except Exception as ex:
-        log.exception('Unknown error when fetching schedule for netlocs.', results_worker=worker_id, exception=str(type(ex)), exception_message=str(ex))
-        raise ex
-    finally:
-        await connection.close()
+    await connection.execute(
+        '''insert into queue (url, netloc, scheduled)
+           select * from unnest($1::varchar[], $2::varchar[], $3::timestamptz[])
+           on conflict do nothing;''',
+        [url.url for url, _ in url_schedule],
+        [url.netloc for url, _ in url_schedule],
+        [scheduled_time for _, scheduled_time in url_schedule]
+    )
 
 
 async def add_to_queue(urls: List[CCUrl], worker_id: int):
-    connection = await get_connection()
-    tr = connection.transaction()
+    found = len(urls)
+    urls = filter_visited(seen_urls.filter(canonicalize_urls(urls)))
+    log.debug('Dropped already queued or visited URLs.', found=found, unseen=len(urls), results_worker=worker_id)
+    if not urls:
+        return
 
     try:
-        t1_start = time.perf_counter()
-        netlocs_schedule = await get_netloc_schedules(urls, worker_id)
-        url_schedule: List[Tuple[CCUrl, datetime.datetime]] = []
-        for url in urls:
-            latest_schedule = netlocs_schedule.get(url.urlparse.netloc, datetime.datetime.now() - datetime.timedelta(minutes=6))
-            next_schedule = latest_schedule + datetime.timedelta(minutes=6)
-            netlocs_schedule[url.urlparse.netloc] = next_schedule
-            url_schedule.append((url, next_schedule))
-        t1_end = time.perf_counter()
+        async with acquire() as connection:
+            t1_start = time.perf_counter()
+            slots = await reserve_netloc_slots(connection, [url.netloc for url in urls])
+            url_schedule: List[Tuple[CCUrl, datetime.datetime]] = [
+                (url, slots[url.netloc].pop(0)) for url in urls
+            ]
+            t1_end = time.perf_counter()
 
-        log.debug('perf_counter add_to_queue netlocs', elapsed=t1_end - t1_start, results_worker=worker_id)
+            log.debug('perf_counter add_to_queue netlocs', elapsed=t1_end - t1_start, results_worker=worker_id)
 
-        t1_start = time.perf_counter()
-        await tr.start()
-        for url, scheduled_time in url_schedule:
-            await queue_url(connection, url, scheduled_time)
-        await tr.commit()
-        t1_end = time.perf_counter()
+            t1_start = time.perf_counter()
+            await queue_urls(connection, url_schedule)
+            seen_urls.add(urls)
+            t1_end = time.perf_counter()
 
-        log.debug('perf_counter add_to_queue transaction', elapsed=t1_end - t1_start, results_worker=worker_id)
+            log.debug('perf_counter add_to_queue insert', elapsed=t1_end - t1_start, results_worker=worker_id)
 
     except Exception as ex:
         log.exception('Unknown error when adding URLs to queue.', results_worker=worker_id, exception=str(type(ex)), exception_message=str(ex))
-    finally:
-        await connection.close()
 
 
-async def queue_sleep(queue: 'Queue[str]'):
-    continue_sleep = True
-    log.info('Queue sleeping.')
-    while continue_sleep:
-        if queue.qsize() < 250:
-            continue_sleep = False
-        else:
-            log.info('Queue is full.', size=queue.qsize())
-            await asyncio.sleep(5)
+def create_frontier() -> 'asyncio.Queue[str]':
+    return asyncio.Queue(maxsize=config.QUEUE_CONFIG.get('frontier_size', 500))
 
 
-async def queue_worker(queue: 'Queue[str]'):
+async def queue_worker(queue: 'asyncio.Queue[str]'):
     log.info('Queue starting')
+    batch_size = config.QUEUE_CONFIG.get('batch_size', 300)
     while True:
         try:
-            next_items = await get_next_queue_items()
+            next_items = await get_next_queue_items(batch_size)
+            # Resolve the hosts while the URLs wait in the frontier, so fetches start with an address in hand.
+            prefetch_urls(next_items)
+            await load_validators(next_items)
+            # put blocks while the frontier is full, so the HTTP workers drain it before we fetch more rows.
             for item in next_items:
-                queue.put(item)
+                await queue.put(item)
 
-            await queue_sleep(queue)
+            if not next_items:
+                await asyncio.sleep(1)
         except Exception as ex:
             log.exception('Something went wrong when fetching queue items.')
             # pass # log.exception('Unknown exception in queue.', exception=ex)
             raise ex
-        finally:
-            await asyncio.sleep(1)
@@ -0,0 +1,116 @@
+import datetime
+import hashlib
+import math
+from typing import Union
+
+from structlog import get_logger
+
+from config import RECRAWL_CONFIG
+from core.database import acquire
+from core.url_parse import CCUrl
+from domain import SessionPairResultsDto, PageChangesObject
+
+log = get_logger()
+
+
+def content_hash(session_pair_results: SessionPairResultsDto) -> Union[str, None]:
+    body = session_pair_results.response_bytes
+    if body is None and session_pair_results.response_body is not None:
+        body = session_pair_results.response_body.encode()
+    if body is None:
+        return None
+
+    return hashlib.sha256(body).hexdigest()
+
+
+def estimate_change_rate(checks: float, changes: float, elapsed: float) -> Union[float, None]:
+    """Changes per second over elapsed seconds, None while there is nothing to estimate from."""
+    if checks <= 0 or elapsed <= 0:
+        return None
+
+    # The Cho and Garcia-Molina estimator, it corrects for the changes missed between two checks.
+    return -math.log((checks - changes + 0.5) / (checks + 0.5)) / (elapsed / checks)
+
+
+def next_interval(checks: float, changes: float, elapsed: float, min_interval: float, max_interval: float, default_interval: float) -> float:
+    """Seconds until the next visit, the expected time between changes clamped to the min and max interval."""
+    rate = estimate_change_rate(checks, changes, elapsed)
+    if rate is None:
+        return default_interval
+    if rate <= 0:
+        # Never seen changing, back off from the average time between checks.
+        return min(max(2 * elapsed / checks, min_interval), max_interval)
+
+    return min(max(1 / rate, min_interval), max_interval)
+
+
+def update_changes(previous: Union[PageChangesObject, None], url: str, digest: Union[str, None], fetched: datetime.datetime, history: float) -> PageChangesObject:
+    """Count a check of the page and whether its content hash changed since the previous one."""
+    if previous is None:
+        return PageChangesObject(url, digest, 0, 0, 0, fetched, fetched)
+
+    factor = 0.5 if 0 < history <= previous.checks else 1
+    # A missing hash, from a 304, counts as unchanged.
+    if digest is None:
+        digest = previous.content_hash
+    changed = digest != previous.content_hash
+
+    return PageChangesObject(
+        url,
+        digest,
+        previous.checks * factor + 1,
+        previous.changes * factor + (1 if changed else 0),
+        previous.elapsed * factor + max((fetched - previous.fetched).total_seconds(), 0),
+        fetched,
+        fetched if changed else previous.changed
+    )
+
+
+async def record_fetch(connection, url: str, digest: Union[str, None], fetched: datetime.datetime, history: float) -> PageChangesObject:
+    async with connection.transaction():
+        value = await connection.fetchrow(
+            '''select * from page_changes where md5(url) = md5($1) and url = $1 for update''',
+            url
+        )
+        changes = update_changes(PageChangesObject(**dict(value)) if value else None, url, digest, fetched, history)
+
+        await connection.execute(
+            '''insert into page_changes (url, content_hash, checks, changes, elapsed, fetched, changed)
+               values ($1, $2, $3, $4, $5, $6, $7)
+               on conflict (md5(url)) do update set
+                   content_hash = excluded.content_hash, checks = excluded.checks, changes = excluded.changes,
+                   elapsed = excluded.elapsed, fetched = excluded.fetched, changed = excluded.changed''',
+            changes.url, changes.content_hash, changes.checks, changes.changes, changes.elapsed, changes.fetched, changes.changed
+        )
+
+    return changes
+
+
+async def schedule_recrawl(session_pair_results: SessionPairResultsDto, digest: Union[str, None], worker_id: int):
+    """Record the fetch and queue the page again for when it is expected to have changed."""
+    if not RECRAWL_CONFIG.get('enabled', False):
+        return
+
+    url = session_pair_results.url
+    try:
+        fetched = datetime.datetime.now(datetime.timezone.utc)
+        async with acquire() as connection:
+            changes = await record_fetch(connection, url, digest, fetched, RECRAWL_CONFIG.get('history', 20))
+            interval = next_interval(
+                changes.checks,
+                changes.changes,
+                changes.elapsed,
+                RECRAWL_CONFIG.get('min_interval', 3600),
+                RECRAWL_CONFIG.get('max_interval', 30 * 24 * 3600),
+                RECRAWL_CONFIG.get('default_interval', 24 * 3600)
+            )
+            # The leased row is rescheduled and released, so acknowledging the result leaves it in place.
+            await connection.execute(
+                '''insert into queue (url, netloc, scheduled) values ($1, $2, $3)
+                   on conflict (md5(url)) do update set scheduled = excluded.scheduled, leased_until = null''',
+                url, CCUrl(url).netloc, fetched + datetime.timedelta(seconds=interval)
+            )
+
+        log.debug('Scheduled recrawl.', url=url, interval=interval, checks=changes.checks, changes=changes.changes, results_worker=worker_id)
+    except Exception as ex:
+        log.exception('Unknown error when scheduling recrawl.', results_worker=worker_id, exception=str(type(ex)), exception_message=str(ex), url=url)
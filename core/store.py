@@ -1,127 +1,175 @@
-from typing import Union, Tuple
-
-import aiofiles
+import asyncio
 import hashlib
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Tuple, Dict
 
 from structlog import get_logger
 
-from core.url_parse import parse_url, CCUrl
-import os.path
+from config import STORAGE_CONFIG
+from domain import SessionPairResultsDto
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+STORAGE_DIRECTORY = STORAGE_CONFIG.get('directory', '/media/puse/disk12/CoolCarabine/')
 
+COMPRESSION_GZIP = 1
+COMPRESSION_ZSTD = 2
 
-STORAGE_DIRECTORY = '/media/puse/disk12/CoolCarabine/'
+# Segment record: magic, sha256 of the uncompressed body, compression, compressed length. The data follows.
+_RECORD = struct.Struct('<4s32sBQ')
+_RECORD_MAGIC = b'CCPG'
+# Index entry: sha256, segment number, offset of the data, compressed length, compression.
+_INDEX = struct.Struct('<32sIQQB')
 
 
 log = get_logger()
 
 
-def hash_value(value: str) -> str:
-    return hashlib.sha256(value.encode()).hexdigest()
+def compress(body: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor().compress(body)
 
+    return zlib.compress(body, 6)
 
-async def write_file(path: str, session_pair_results: SessionPairResults):
-    try:
-        async with aiofiles.open(path, 'w') as fd:
-            await fd.write(session_pair_results.response_body)
-    except Exception as ex:
-        pass # log.exception('Unknown exception when writing to file.', path=path, url=session_pair_results.url, exception=ex)
-        raise ex
 
-async def store_index(session_pair_results: SessionPairResults, folder_path: str, url: str, name='index.html'):
-    await write_file(os.path.join(folder_path, hash_value(name)), session_pair_results.response_body, url)
+def decompress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data)
 
+    return zlib.decompress(data)
 
-def get_path(session_pair_results: SessionPairResults) -> Tuple[str, str]:
-    parsed: CCUrl = parse_url(session_pair_results.session_pair.url)
-    netloc_hash = hash_value(parsed.urlparse.netloc)
-    netloc_path = netloc_hash
 
-    if parsed.urlparse.path == '' or parsed.urlparse.path == '/':
-        return netloc_path, hash_value('index.html')
+class PageStore:
+    """Compressed segment files with a sha256 index, identical bodies are stored once."""
 
-    page_path = parsed.urlparse.path.split('/')
-    if page_path[0] == '':
-        page_path = page_path[1:]
+    def __init__(self, directory: str, name: str, segment_size: int = 1024 ** 3, compression: str = 'gzip'):
+        self._directory = directory
+        self._name = name
+        self._segment_size = segment_size
+        self._compression = COMPRESSION_ZSTD if compression == 'zstd' and zstandard is not None else COMPRESSION_GZIP
+        self._index: Dict[bytes, Tuple[int, int, int, int]] = dict()
+        self._segment_number = 0
+        self._segment = None
 
-    if len(page_path) == 1:
-        return netloc_path, hash_value(page_path[0])
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+        self._index_file = open(self._path('idx'), 'ab')
+        self._url_log = open(self._path('urls'), 'a')
+        self._open_segment()
 
-    page_name = hash_value('index.html')
-    if page_path[-1] != '':
-        page_name = hash_value(page_path[-1])
+    def __len__(self):
+        return len(self._index)
 
-    page_path = page_path[:-1]
-    current_path = netloc_path
-    for folder in page_path:
-        current_path = os.path.join(current_path, hash_value(folder))
+    def _path(self, extension: str, segment_number: Union[int, None] = None) -> str:
+        if segment_number is None:
+            return os.path.join(self._directory, f'{self._name}.{extension}')
 
-    path = os.path.join(current_path, page_name)
+        return os.path.join(self._directory, f'{self._name}-{segment_number:05d}.{extension}')
 
-    return current_path, page_name
+    def _load_index(self):
+        if not os.path.exists(self._path('idx')):
+            return
 
+        with open(self._path('idx'), 'rb') as fd:
+            data = fd.read()
 
-def path_contains_file(path: str) -> Tuple[bool, str]:
-    splitted = os.path.split(path)
-    current_path = ''
+        # A partially written last entry is ignored.
+        for offset in range(0, len(data) - _INDEX.size + 1, _INDEX.size):
+            digest, segment_number, data_offset, length, compression = _INDEX.unpack_from(data, offset)
+            self._index[digest] = (segment_number, data_offset, length, compression)
+            self._segment_number = max(self._segment_number, segment_number)
 
-    for directory in splitted:
-        current_path = os.path.join(current_path, directory)
+    def _open_segment(self):
+        if self._segment is not None:
+            self._segment.close()
 
-        if not os.path.exists(os.path.join(STORAGE_DIRECTORY, current_path)):
-            return False, current_path
+        self._segment = open(self._path('seg', self._segment_number), 'ab')
+        if self._segment.tell() >= self._segment_size:
+            self._segment_number += 1
+            self._open_segment()
 
-        if os.path.isfile(os.path.join(STORAGE_DIRECTORY, current_path)):
-            return True, current_path
+    def put(self, url: str, body: bytes) -> Tuple[str, bool]:
+        """Store a body, returns its sha256 hex digest and whether it was new."""
+        digest = hashlib.sha256(body).digest()
+        stored = digest not in self._index
 
-    return False, current_path
+        if stored:
+            data = compress(body, self._compression)
+            if self._segment.tell() + _RECORD.size + len(data) > self._segment_size and self._segment.tell() > 0:
+                self._segment_number += 1
+                self._open_segment()
 
+            offset = self._segment.tell() + _RECORD.size
+            self._segment.write(_RECORD.pack(_RECORD_MAGIC, digest, self._compression, len(data)))
+            self._segment.write(data)
+            self._segment.flush()
 
-def make_file_index(path: str, file_name: str):
-    os.rename(
-        os.path.join(STORAGE_DIRECTORY, path, file_name),
-        os.path.join(STORAGE_DIRECTORY, path, f'tmp_{file_name}')
-    )
+            location = (self._segment_number, offset, len(data), self._compression)
+            self._index_file.write(_INDEX.pack(digest, *location))
+            self._index_file.flush()
+            self._index[digest] = location
 
-    os.mkdir(os.path.join(STORAGE_DIRECTORY, path, file_name))
+        self._url_log.write(f'{int(time.time())}\t{digest.hex()}\t{url}\n')
+        self._url_log.flush()
 
-    os.rename(
-        os.path.join(STORAGE_DIRECTORY, path, f'tmp_{file_name}'),
-        os.path.join(STORAGE_DIRECTORY, path, file_name, hash_value('index.html'))
-    )
+        return digest.hex(), stored
 
+    def get(self, sha256: str) -> Union[bytes, None]:
+        location = self._index.get(bytes.fromhex(sha256))
+        if location is None:
+            return None
 
-def create_path_tree(path: str):
-    splitted = os.path.split(path)
-    current_path = ''
+        segment_number, offset, length, compression = location
+        with open(self._path('seg', segment_number), 'rb') as fd:
+            fd.seek(offset)
+            return decompress(fd.read(length), compression)
 
-    for directory in splitted:
-        old_path = current_path
-        current_path = os.path.join(current_path, directory)
-        full_path = os.path.join(STORAGE_DIRECTORY, current_path)
+    def close(self):
+        self._segment.close()
+        self._index_file.close()
+        self._url_log.close()
 
-        if not os.path.exists(full_path):
-            os.mkdir(full_path)
-        else:
-            if os.path.isfile(path):
-                make_file_index(old_path, directory)
 
+_store: Union[PageStore, None] = None
+# A single thread keeps the appends of a process ordered and off the event loop.
+_executor = ThreadPoolExecutor(max_workers=1)
 
-async def store_page(session_pair_results: SessionPairResults):
-    path, file_name = get_path(session_pair_results)
 
-    try:
-        create_path_tree(path)
-    except Exception as ex:
-        # TODO logging
-        pass # log.exception('Unknown exception when creating directory.', path=path, url=session_pair_results.url, exception=ex)
-        return
+def get_store(worker_id: int) -> PageStore:
+    global _store
 
-    file_path = os.path.join(STORAGE_DIRECTORY, path, file_name)
-    try:
-        await write_file(file_path, session_pair_results)
-    except Exception as ex:
-        pass # log.exception('Unknown exception when writing to file', exception=ex, url=session_pair_results.url, file_path=file_path)
-        return
+    # One store per results worker, named by worker id so it finds its index again after a restart.
+    if _store is None:
+        _store = PageStore(
+            STORAGE_DIRECTORY,
+            f'pages-{worker_id}',
+            STORAGE_CONFIG.get('segment_size', 1024 ** 3),
+            STORAGE_CONFIG.get('compression', 'gzip')
+        )
+
+    return _store
 
 
+async def store_page(session_pair_results: SessionPairResultsDto, worker_id: int) -> Union[str, None]:
+    body = session_pair_results.response_bytes
+    if body is None and session_pair_results.response_body is not None:
+        body = session_pair_results.response_body.encode()
+    if body is None:
+        return None
+
+    try:
+        digest, stored = await asyncio.get_event_loop().run_in_executor(_executor, lambda: get_store(worker_id).put(session_pair_results.url, body))
+        log.debug('Stored page.', url=session_pair_results.url, sha256=digest, new=stored, results_worker=worker_id)
+        return digest
+    except Exception as ex:
+        log.exception('Unknown exception when storing page.', url=session_pair_results.url, results_worker=worker_id, exception=str(type(ex)), exception_message=str(ex))
 
+    return None
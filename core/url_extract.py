@@ -1,35 +1,119 @@
+import html
+import re
 import time
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Union, Callable, Dict, Iterator
 
-from bs4 import BeautifulSoup
 from structlog import get_logger
 
-from core.url_parse import parse_url, parse_extracted_url_list, CCUrl
-from domain import SessionPairResultsDto
+from config import PARSE_CONFIG
+from core.url_parse import parse_url, parse_extracted_url, parse_extracted_url_list, CCUrl
+from domain import SessionPairResultsDto, decode_body
 
 
 log = get_logger()
 
+# Comments, scripts and styles are matched as a whole so anchors inside them are skipped, like html.parser does.
+# An unclosed one, or an unclosed tag, runs to the end of the document once instead of being rescanned for every
+# opener. Unclosed tags are matched without the closing group and skipped, html.parser keeps them as text.
+_TAG_REGEX = re.compile(
+    r'<!--.*?(?:-->|\Z)'
+    r'|<script\b.*?(?:</script\s*>|\Z)'
+    r'|<style\b.*?(?:</style\s*>|\Z)'
+    r'|<(a|base)(?=[\s/>])((?:"[^"]*"|\'[^\']*\'|[^\'">])*)(?:(>)|\Z)',
+    re.IGNORECASE | re.DOTALL
+)
+_ATTRIBUTE_REGEX = re.compile(
+    r'([^\s"\'=<>/]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?'
+)
 
-def parse_html(session_pair_results: SessionPairResultsDto, worker_id: int) -> List[str]:
-    bs_start = time.perf_counter()
-    soup = BeautifulSoup(session_pair_results.response_body, 'html.parser')
-    links = soup.find_all('a')
-    bs_end = time.perf_counter()
-    log.debug('BeautifulSoup perf_counter', results_worker=worker_id, start=bs_start, end=bs_end, elapsed=bs_end - bs_start, url=session_pair_results.url)
 
-    return links
+def _get_href(attributes: str) -> Union[str, None]:
+    for match in _ATTRIBUTE_REGEX.finditer(attributes):
+        if match.group(1).lower() != 'href':
+            continue
+
+        value = match.group(2)
+        if value is None:
+            value = match.group(3)
+        if value is None:
+            value = match.group(4)
+        if value is None:
+            # <a href> without a value.
+            return ''
+
+        return html.unescape(value)
+
+    return None
+
+
+def iter_hrefs_tokenizer(body: str) -> Iterator[Tuple[str, Union[str, None]]]:
+    """Yield (tag, href) for every <a> and <base> tag without building a document tree."""
+    for match in _TAG_REGEX.finditer(body):
+        tag = match.group(1)
+        if tag is None or match.group(3) is None:
+            continue
+
+        yield tag.lower(), _get_href(match.group(2))
+
+
+def extract_hrefs_tokenizer(body: str) -> Tuple[Union[str, None], List[str]]:
+    base_href: Union[str, None] = None
+    hrefs: List[str] = []
+
+    for tag, href in iter_hrefs_tokenizer(body):
+        if tag == 'a':
+            hrefs.append(href)
+        elif base_href is None and href:
+            base_href = href
+
+    return base_href, hrefs
+
+
+def extract_hrefs_bs4(body: str) -> Tuple[Union[str, None], List[str]]:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(body, 'html.parser')
+    base = soup.find('base', href=True)
+
+    return base.get('href') if base else None, [link.get('href') for link in soup.find_all('a')]
+
+
+EXTRACTORS: Dict[str, Callable[[str], Tuple[Union[str, None], List[str]]]] = {
+    'tokenizer': extract_hrefs_tokenizer,
+    'bs4': extract_hrefs_bs4
+}
+
+
+def get_extractor() -> Callable[[str], Tuple[Union[str, None], List[str]]]:
+    return EXTRACTORS[PARSE_CONFIG.get('core.url_extract', {}).get('extractor', 'tokenizer')]
+
+
+def parse_html(session_pair_results: SessionPairResultsDto, worker_id: int) -> Tuple[Union[str, None], List[str]]:
+    parse_start = time.perf_counter()
+    extractor = get_extractor()
+    try:
+        base_href, hrefs = extractor(session_pair_results.response_body)
+    except Exception as ex:
+        if extractor is extract_hrefs_bs4:
+            raise ex
+
+        log.exception('Link extractor failed, falling back to BeautifulSoup.', results_worker=worker_id, url=session_pair_results.url)
+        base_href, hrefs = extract_hrefs_bs4(session_pair_results.response_body)
+    parse_end = time.perf_counter()
+    log.debug('Link extraction perf_counter', results_worker=worker_id, start=parse_start, end=parse_end, elapsed=parse_end - parse_start, url=session_pair_results.url)
+
+    return base_href, hrefs
 
 
 async def extract_urls(session_pair_results: SessionPairResultsDto, worker_id: int) -> List[CCUrl]:
     try:
-        links = parse_html(session_pair_results, worker_id)
+        base_href, hrefs = parse_html(session_pair_results, worker_id)
 
         parse_start = time.perf_counter()
         base_url = parse_url(session_pair_results.url)
-        hrefs: List[str] = []
-        for link in links:
-            hrefs.append(link.get('href'))
+        if base_href is not None and base_href.strip() != '':
+            base_url = parse_extracted_url(base_url, base_href)
         parsed = parse_extracted_url_list(base_url, hrefs, worker_id)
         parse_end = time.perf_counter()
 
@@ -44,6 +128,41 @@ async def extract_urls(session_pair_results: SessionPairResultsDto, worker_id: i
     return []
 
 
+def extract_url_list(url: str, body: bytes, charset: Union[str, None]) -> List[str]:
+    """Decode, extract and parse the links of a page in the parse process pool, it only takes and returns plain values."""
+    session_pair_results = SessionPairResultsDto(None, None, decode_body(body, charset))
+    session_pair_results.url = url
+    base_href, hrefs = parse_html(session_pair_results, -1)
+
+    base_url = parse_url(url)
+    if base_href is not None and base_href.strip() != '':
+        base_url = parse_extracted_url(base_url, base_href)
+
+    return [parsed.url for parsed in parse_extracted_url_list(base_url, hrefs, -1)]
+
+
+_parse_pool: Union[ProcessPoolExecutor, None] = None
+
+
+def get_parse_pool() -> Union[ProcessPoolExecutor, None]:
+    """The parse process pool of this process, None when parsing is left to the results workers."""
+    global _parse_pool
+
+    workers = PARSE_CONFIG.get('workers', 0)
+    if _parse_pool is None and workers > 0:
+        _parse_pool = ProcessPoolExecutor(max_workers=workers)
+
+    return _parse_pool
+
+
+def shutdown_parse_pool():
+    global _parse_pool
+
+    if _parse_pool is not None:
+        _parse_pool.shutdown()
+        _parse_pool = None
+
+
 class UrlExtract():
     async def next(self, session_pair_results: SessionPairResultsDto, worker_id: int) -> List[CCUrl]:
-        pass
\ No newline at end of file
+        pass
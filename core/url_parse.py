@@ -1,63 +1,132 @@
 import re
-from typing import List
-from urllib.parse import urlparse, urljoin, ParseResult
+from functools import lru_cache
+from typing import List, Union, Dict
+from urllib.parse import urlparse, urlsplit, urlunsplit, urljoin, ParseResult
 
-import validators
-from django.core.validators import URLValidator
-from django.core.exceptions import ValidationError
 from structlog import get_logger
 
 log = get_logger()
 
+_URL_REGEX = re.compile(
+    r'^(?:http|ftp)s?://'  # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # domain...
+    r'localhost|'  # localhost...
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
+    r'(?::\d+)?'  # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
+# Django and validators are imported on first use, Django is only needed for the few URLs where the regex and
+# validators disagree so most worker processes never load it.
+_django_url_validator = None
+
+
+def _url_validator_regex_001(url: str) -> int:
+    return 1 if _URL_REGEX.match(url) else 0
+
+
+def _url_validator_django(url: str) -> int:
+    global _django_url_validator
+    from django.core.exceptions import ValidationError
+
+    if _django_url_validator is None:
+        from django.core.validators import URLValidator
+        _django_url_validator = URLValidator()
+
+    try:
+        _django_url_validator(url)
+        return 1
+    except ValidationError:
+        return 0
+
+
+def _url_validator_validators(url: str) -> int:
+    import validators
+
+    return 1 if validators.url(url) else 0
+
+
+@lru_cache(maxsize=65536)
+def is_valid_url(url: str) -> bool:
+    """2 of 3 vote between the regex, validators and Django."""
+    # Django is only asked when the two cheap ones disagree, the verdict is the same as running all three.
+    regex = _url_validator_regex_001(url)
+    if regex == _url_validator_validators(url):
+        return regex == 1
+
+    return _url_validator_django(url) == 1
+
+
+def validate_urls(urls: List[str]) -> List[bool]:
+    return [is_valid_url(url) for url in urls]
+
+
+def is_relative(url: str) -> bool:
+    return url.startswith('.') or (url.startswith('/') and not is_protocol_relative(url))
+
+
+def is_protocol_relative(url: str) -> bool:
+    return url.startswith('//')
+
 
 class CCUrl:
+    __slots__ = ('url', '_urlparse', '_netloc', '_scheme')
+
     def __init__(self, url: str):
         self.url = url
-        self.urlparse: ParseResult = urlparse(url)
+        # Parsed on first access, most extracted URLs only ever need the netloc.
+        self._urlparse: Union[ParseResult, None] = None
+        self._netloc: Union[str, None] = None
+        self._scheme: Union[str, None] = None
+
+    @property
+    def urlparse(self) -> ParseResult:
+        if self._urlparse is None:
+            self._urlparse = urlparse(self.url)
+
+        return self._urlparse
+
+    def _split(self):
+        split = urlsplit(self.url)
+        self._netloc = split.netloc
+        self._scheme = split.scheme
+
+    @property
+    def netloc(self) -> str:
+        if self._netloc is None:
+            self._split()
+
+        return self._netloc
+
+    @property
+    def scheme(self) -> str:
+        if self._scheme is None:
+            self._split()
+
+        return self._scheme
 
     def is_relative(self) -> bool:
-        if self.url.startswith('.'):
-            return True
-        if self.url.startswith('/') and not self.is_protocol_relative():
-            return True
+        return is_relative(self.url)
 
     def set_scheme(self, scheme: str):
-        self.urlparse = self.urlparse._replace(scheme=scheme)
-        self.url = self.urlparse.geturl()
+        self._urlparse = self.urlparse._replace(scheme=scheme)
+        self.url = self._urlparse.geturl()
+        self._netloc = None
+        self._scheme = None
 
     def is_protocol_relative(self) -> bool:
-        return self.url.startswith('//')
+        return is_protocol_relative(self.url)
 
     def _url_validator_regex_001(self) -> int:
-        regex = re.compile(
-            r'^(?:http|ftp)s?://'  # http:// or https://
-            r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # domain...
-            r'localhost|'  # localhost...
-            r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-            r'(?::\d+)?'  # optional port
-            r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-
-        return 1 if re.match(regex, self.url) else 0
+        return _url_validator_regex_001(self.url)
 
     def _url_validator_django(self) -> int:
-        validate = URLValidator()
-        try:
-            validate(self.url)
-            return 1
-        except ValidationError:
-            return 0
+        return _url_validator_django(self.url)
 
     def _url_validator_validators(self):
-        return 1 if validators.url(self.url) else 0
+        return _url_validator_validators(self.url)
 
     def is_valid(self) -> bool:
-        my_validators = [
-            self._url_validator_regex_001(),
-            self._url_validator_django(),
-            self._url_validator_validators()
-        ]
-
-        valid = sum(my_validators) >= 2
+        valid = is_valid_url(self.url)
         # if valid and not self.urlparse.netloc.lower().endswith('.no'):
         #    return False
         return valid
@@ -82,11 +151,48 @@ def parse_extracted_url(base: CCUrl, href: str) -> CCUrl:
         return join_url(base, href_parsed)
 
     if href_parsed.is_protocol_relative():
-        href_parsed.set_scheme(base.urlparse.scheme)
+        href_parsed.set_scheme(base.scheme)
 
     return href_parsed
 
 
+_DEFAULT_PORTS = {'http': '80', 'https': '443', 'ftp': '21'}
+
+
+def canonicalize_url(url: str) -> str:
+    """Normalize the parts of a URL that do not change what is fetched."""
+    split = urlsplit(url)
+    scheme = split.scheme.lower()
+
+    userinfo, at, hostport = split.netloc.rpartition('@')
+    hostport = hostport.lower()
+    host, colon, port = hostport.rpartition(':')
+    # The ] check keeps the last group of an IPv6 address from being taken as a port.
+    if colon and ']' not in port and (port == '' or port == _DEFAULT_PORTS.get(scheme)):
+        hostport = host
+    netloc = userinfo + at + hostport
+
+    path = split.path
+    if path == '' and netloc:
+        path = '/'
+
+    # Sort the raw parameters so the encoding of each one is left untouched.
+    query = '&'.join(sorted(parameter for parameter in split.query.split('&') if parameter))
+
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def canonicalize_urls(urls: List[CCUrl]) -> List[CCUrl]:
+    """Canonicalize and drop duplicates, keeping the order of first occurrence."""
+    canonical: Dict[str, CCUrl] = dict()
+    for url in urls:
+        canonical_url = canonicalize_url(url.url)
+        if canonical_url not in canonical:
+            canonical[canonical_url] = url if canonical_url == url.url else CCUrl(canonical_url)
+
+    return list(canonical.values())
+
+
 def filter_url(url: str) -> bool:
     # Filter out "empty" values.
     if url is None or url.strip() == '':
@@ -105,7 +211,8 @@ def filter_parsed_urls(parsed_urls: List[CCUrl], worker_id: int):
     filtered_urls: List[CCUrl] = []
 
     for url in parsed_urls:
-        if url.is_valid() and url.urlparse.netloc.lower().endswith('.no'):
+        # The netloc check is cheap and drops most URLs before they reach the validators.
+        if url.netloc.lower().endswith('.no') and url.is_valid():
             filtered_urls.append(url)
         else:
             log.debug('Second pass filter removed a URL.', results_worker=worker_id, url=url.url)
@@ -113,11 +220,29 @@ def filter_parsed_urls(parsed_urls: List[CCUrl], worker_id: int):
 
 
 def parse_extracted_url_list(base: CCUrl, hrefs: List[str], worker_id: int) -> List[CCUrl]:
-    filtered_hrefs: List[str] = []
+    """Same result as parse_extracted_url for every kept href, but works on strings and builds one CCUrl per link."""
+    base_url = base.url
+    base_scheme = base.scheme
+    parsed: List[CCUrl] = []
+
     for href in hrefs:
-        if filter_url(href):
-            filtered_hrefs.append(href)
+        if not filter_url(href):
+            continue
 
-    parsed = [parse_extracted_url(base, href) for href in filtered_hrefs]
+        href = href.strip()
+        try:
+            if is_relative(href):
+                href = urljoin(base_url, href)
+            elif is_protocol_relative(href):
+                href = urlparse(href)._replace(scheme=base_scheme).geturl()
+
+            url = CCUrl(href)
+            # Split here so a malformed href, like an unclosed IPv6 bracket, drops the link and not the page.
+            url._split()
+        except ValueError:
+            log.debug('Dropped a URL that could not be parsed.', results_worker=worker_id, url=href)
+            continue
+
+        parsed.append(url)
 
     return filter_parsed_urls(parsed, worker_id)
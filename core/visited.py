@@ -0,0 +1,113 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+from typing import Union, List
+
+from structlog import get_logger
+
+from config import VISITED_CONFIG, HTTP_CONFIG
+from core.url_parse import CCUrl, canonicalize_url
+from domain import SessionPairResultsDto
+
+log = get_logger()
+
+# Responses that say nothing about the page, the same statuses count as failures in the fetcher.
+FAILURE_STATUSES = frozenset(HTTP_CONFIG.get('worker', {}).get('health', {}).get('failure_statuses', [429, 502, 503, 504]))
+
+_HEADER = struct.Struct('<4sIIQ')
+_MAGIC = b'CCBF'
+_VERSION = 1
+
+
+class BloomFilter:
+    """Bloom filter over a memory mapped file, shared by every process that opens it."""
+
+    def __init__(self, path: str, capacity: int, error_rate: float):
+        self._path = path
+        size = -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        self._bits = max(8, int(math.ceil(size / 8)) * 8)
+        self._hashes = max(1, int(round(self._bits / capacity * math.log(2))))
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        length = _HEADER.size + self._bits // 8
+        if os.fstat(self._fd).st_size == 0:
+            os.ftruncate(self._fd, length)
+            os.pwrite(self._fd, _HEADER.pack(_MAGIC, _VERSION, self._hashes, self._bits), 0)
+        else:
+            self._check_header(length)
+
+        self._map = mmap.mmap(self._fd, length)
+
+    def _check_header(self, length: int):
+        magic, version, hashes, bits = _HEADER.unpack(os.pread(self._fd, _HEADER.size, 0))
+        if magic != _MAGIC or version != _VERSION or os.fstat(self._fd).st_size != length:
+            raise ValueError(f'{self._path} is not a visited filter of this size.')
+
+        self._hashes = hashes
+        self._bits = bits
+
+    def _positions(self, value: str) -> List[int]:
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return [_HEADER.size * 8 + (h1 + i * h2) % self._bits for i in range(self._hashes)]
+
+    def add(self, value: str):
+        # No locking, two processes setting bits in the same byte can lose one. That costs a refetch, never a missed URL.
+        for position in self._positions(value):
+            index = position >> 3
+            self._map[index] |= 1 << (position & 7)
+
+    def __contains__(self, value: str) -> bool:
+        for position in self._positions(value):
+            if not self._map[position >> 3] & (1 << (position & 7)):
+                return False
+
+        return True
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        os.close(self._fd)
+
+
+_visited: Union[BloomFilter, None] = None
+
+
+def get_visited_filter() -> Union[BloomFilter, None]:
+    """The filter of this process, opened on first use so it is mapped after the results processes are forked."""
+    global _visited
+
+    if _visited is None and VISITED_CONFIG.get('enabled', False):
+        _visited = BloomFilter(
+            VISITED_CONFIG.get('path', 'visited.bloom'),
+            VISITED_CONFIG.get('capacity', 50000000),
+            VISITED_CONFIG.get('error_rate', 0.01)
+        )
+
+    return _visited
+
+
+def is_fetched(session_pair_results: SessionPairResultsDto) -> bool:
+    """Whether the page was actually fetched, timeouts, connection errors and overload responses are retried on rediscovery."""
+    response = session_pair_results.client_response
+    return response is not None and response.status is not None and response.status not in FAILURE_STATUSES
+
+
+def mark_visited(url: str):
+    visited = get_visited_filter()
+    if visited is not None:
+        visited.add(canonicalize_url(url))
+
+
+def filter_visited(urls: List[CCUrl]) -> List[CCUrl]:
+    """Drop URLs that were fetched before, the URLs are expected to be canonical already."""
+    visited = get_visited_filter()
+    if visited is None:
+        return urls
+
+    return [url for url in urls if url.url not in visited]
@@ -1,8 +1,63 @@
+import codecs
+import datetime
+import struct
 from dataclasses import dataclass
-from typing import Union, Dict
+from typing import Union, Dict, Tuple, List, TYPE_CHECKING
 
-from aiohttp import ClientSession, ClientResponse
-from multidict import CIMultiDictProxy
+if TYPE_CHECKING:
+    from aiohttp import ClientSession, ClientResponse
+    from multidict import CIMultiDictProxy
+
+
+# Response headers kept on the DTO, the rest are dropped before the result is sent to the results workers.
+KEPT_HEADERS = ('ETag', 'Last-Modified')
+
+_WIRE_VERSION = 1
+_WIRE_PREFIX = struct.Struct('<BBHB')
+_WIRE_LENGTH = struct.Struct('<I')
+_WIRE_NONE = 0xFFFFFFFF
+_FLAG_CLIENT_RESPONSE = 1
+_FLAG_REDIRECTED = 2
+_FLAG_TEXT_BODY = 4
+_FLAG_EXTRACTED_URLS = 8
+
+
+def _write_value(buffer: bytearray, value: Union[str, bytes, None]):
+    if value is None:
+        buffer += _WIRE_LENGTH.pack(_WIRE_NONE)
+        return
+
+    data = value if isinstance(value, bytes) else value.encode('utf-8', 'surrogatepass')
+    buffer += _WIRE_LENGTH.pack(len(data))
+    buffer += data
+
+
+def _read_value(data: memoryview, offset: int, raw: bool = False) -> Tuple[Union[str, bytes, None], int]:
+    length, = _WIRE_LENGTH.unpack_from(data, offset)
+    offset += _WIRE_LENGTH.size
+    if length == _WIRE_NONE:
+        return None, offset
+
+    value = data[offset:offset + length]
+    return bytes(value) if raw else str(value, 'utf-8', 'surrogatepass'), offset + length
+
+
+def decode_body(body: bytes, charset: Union[str, None]) -> str:
+    """Decode like ClientResponse.text, the charset from the headers or a detected one."""
+    if charset:
+        try:
+            codecs.lookup(charset)
+        except LookupError:
+            charset = None
+
+    if not charset:
+        try:
+            import cchardet as chardet
+        except ImportError:
+            import chardet
+        charset = chardet.detect(body)['encoding'] or 'utf-8'
+
+    return body.decode(charset)
 
 
 class HttpClientResponseDto:
@@ -13,7 +68,7 @@ class HttpClientResponseDto:
     headers: Union[Dict[str, str], None] = None
     redirected: bool = False
 
-    def __init__(self, client_response: Union[ClientResponse, None] = None):
+    def __init__(self, client_response: 'Union[ClientResponse, None]' = None):
         if client_response:
             self.status = client_response.status
             self.reason = client_response.reason
@@ -24,10 +79,12 @@ class HttpClientResponseDto:
             if client_response.headers:
                 self._parse_headers(client_response.headers)
 
-    def _parse_headers(self, headers: CIMultiDictProxy):
+    def _parse_headers(self, headers: 'CIMultiDictProxy'):
         self.headers = dict()
-        for k, v in headers.items():
-            self.headers[k] = v
+        for name in KEPT_HEADERS:
+            value = headers.get(name)
+            if value is not None:
+                self.headers[name] = value
 
     def __str__(self):
         return f'status="{self.status}", reason="{self.reason}", content_type="{self.content_type}" charset="{self.charset}" redirected="{self.redirected}"'
@@ -36,9 +93,13 @@ class HttpClientResponseDto:
 class SessionPairResultsDto:
     url: Union[str, None] = None
     client_response: Union[HttpClientResponseDto, None] = None
-    response_body: Union[str, None] = None
+    # The raw body as fetched, it is decoded on first access of response_body in the results worker.
+    response_bytes: Union[bytes, None] = None
+    _response_text: Union[str, None] = None
+    # Set when the links were already extracted in the parse process pool on the HTTP side.
+    extracted_urls: Union[List[str], None] = None
 
-    def __init__(self, session_pair: 'Union[SessionPair, None]', client_response: Union[HttpClientResponseDto, None], response_body: Union[str, None]):
+    def __init__(self, session_pair: 'Union[SessionPair, None]', client_response: Union[HttpClientResponseDto, None], response_body: Union[str, bytes, None]):
         if session_pair:
             self.url = session_pair.url
 
@@ -46,15 +107,115 @@ class SessionPairResultsDto:
             self.client_response = client_response
 
         if response_body:
-            self.response_body = response_body
+            if isinstance(response_body, bytes):
+                self.response_bytes = response_body
+            else:
+                self._response_text = response_body
+
+    def has_body(self) -> bool:
+        return self.response_bytes is not None or self._response_text is not None
+
+    @property
+    def response_body(self) -> Union[str, None]:
+        if self._response_text is None and self.response_bytes is not None:
+            try:
+                self._response_text = decode_body(self.response_bytes, self.client_response.charset if self.client_response else None)
+            except UnicodeDecodeError:
+                self.response_bytes = None
+
+        return self._response_text
+
+    def to_bytes(self) -> bytes:
+        """Compact length prefixed encoding used between the HTTP and results processes."""
+        # A fixed prefix with the status and flags, then the url, reason, content type, charset, kept headers, the body
+        # as fetched and the URLs extracted on the HTTP side.
+        response = self.client_response
+        flags = 0
+        status = 0
+        headers: Dict[str, str] = dict()
+        if response is not None:
+            flags |= _FLAG_CLIENT_RESPONSE
+            if response.redirected:
+                flags |= _FLAG_REDIRECTED
+            status = response.status or 0
+            headers = response.headers or headers
+
+        body: Union[str, bytes, None] = self.response_bytes
+        if body is None and self._response_text is not None:
+            flags |= _FLAG_TEXT_BODY
+            body = self._response_text
+
+        if self.extracted_urls is not None:
+            flags |= _FLAG_EXTRACTED_URLS
+
+        buffer = bytearray(_WIRE_PREFIX.pack(_WIRE_VERSION, flags, status, len(headers)))
+        _write_value(buffer, self.url)
+        _write_value(buffer, response.reason if response else None)
+        _write_value(buffer, response.content_type if response else None)
+        _write_value(buffer, response.charset if response else None)
+        for name, value in headers.items():
+            _write_value(buffer, name)
+            _write_value(buffer, value)
+        _write_value(buffer, body)
+        if self.extracted_urls is not None:
+            buffer += _WIRE_LENGTH.pack(len(self.extracted_urls))
+            for url in self.extracted_urls:
+                _write_value(buffer, url)
+
+        return bytes(buffer)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'SessionPairResultsDto':
+        view = memoryview(data)
+        version, flags, status, header_count = _WIRE_PREFIX.unpack_from(view, 0)
+        if version != _WIRE_VERSION:
+            raise ValueError(f'Unknown wire version {version}.')
+
+        offset = _WIRE_PREFIX.size
+        url, offset = _read_value(view, offset)
+        reason, offset = _read_value(view, offset)
+        content_type, offset = _read_value(view, offset)
+        charset, offset = _read_value(view, offset)
+        headers: Dict[str, str] = dict()
+        for _ in range(header_count):
+            name, offset = _read_value(view, offset)
+            headers[name], offset = _read_value(view, offset)
+        body, offset = _read_value(view, offset, raw=True)
+        if body is not None and flags & _FLAG_TEXT_BODY:
+            body = str(body, 'utf-8', 'surrogatepass')
+
+        extracted_urls: Union[List[str], None] = None
+        if flags & _FLAG_EXTRACTED_URLS:
+            count, = _WIRE_LENGTH.unpack_from(view, offset)
+            offset += _WIRE_LENGTH.size
+            extracted_urls = []
+            for _ in range(count):
+                url_value, offset = _read_value(view, offset)
+                extracted_urls.append(url_value)
+
+        client_response = None
+        if flags & _FLAG_CLIENT_RESPONSE:
+            client_response = HttpClientResponseDto()
+            client_response.status = status or None
+            client_response.reason = reason
+            client_response.content_type = content_type
+            client_response.charset = charset
+            client_response.redirected = bool(flags & _FLAG_REDIRECTED)
+            client_response.headers = headers or None
+
+        results = cls(None, client_response, body)
+        results.url = url
+        results.extracted_urls = extracted_urls
+        return results
 
     def __str__(self):
-        return f'url="{self.url}", client_response="{self.client_response}" response_body="<{len(self.response_body) if self.response_body is not None else "None"}/REDACTED>"'
+        body = self.response_bytes if self.response_bytes is not None else self._response_text
+        return f'url="{self.url}", client_response="{self.client_response}" response_body="<{len(body) if body is not None else "None"}/REDACTED>"'
 
 
 @dataclass
 class SessionPair:
-    session: ClientSession
+    session: 'ClientSession'
     url: str
 
     def __str__(self):
@@ -67,6 +228,7 @@ class QueueObject:
     url: str
     scheduled: str
     netloc: str
+    leased_until: Union[str, None] = None
 
 
 @dataclass
@@ -74,3 +236,14 @@ class VisitObject:
     id: int
     netloc: str
     time_stamp: str
+
+
+@dataclass
+class PageChangesObject:
+    url: str
+    content_hash: Union[str, None]
+    checks: float
+    changes: float
+    elapsed: float
+    fetched: datetime.datetime
+    changed: datetime.datetime
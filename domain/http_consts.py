@@ -2,3 +2,8 @@
 
 class ContentTypes:
     TEXT_HTML = 'text/html'
+
+
+class StatusCodes:
+    OK = 200
+    NOT_MODIFIED = 304
@@ -0,0 +1,12 @@
+create table netloc_schedule
+(
+    netloc    varchar                  not null
+        constraint netloc_schedule_pk
+            primary key,
+    next_slot timestamp with time zone not null,
+    tokens    real,
+    updated   timestamp with time zone not null
+);
+
+alter table netloc_schedule
+    owner to root;
@@ -0,0 +1,16 @@
+-- Drop duplicate URLs so the unique index can be created, keep the oldest row.
+delete from queue a
+    using queue b
+where md5(a.url) = md5(b.url)
+  and a.url = b.url
+  and a.id > b.id;
+
+-- Hash the URL so long URLs stay below the btree row size limit, on conflict do nothing in add_to_queue relies on it.
+create unique index queue_url_md5_uindex
+    on queue (md5(url));
+
+create index queue_scheduled_index
+    on queue (scheduled);
+
+create index queue_netloc_scheduled_index
+    on queue (netloc, scheduled desc);
@@ -0,0 +1,2 @@
+alter table queue
+    add leased_until timestamp with time zone;
@@ -0,0 +1,11 @@
+create table netloc_probes
+(
+    netloc varchar                  not null
+        constraint netloc_probes_pk
+            primary key,
+    status varchar                  not null,
+    probed timestamp with time zone not null
+);
+
+alter table netloc_probes
+    owner to root;
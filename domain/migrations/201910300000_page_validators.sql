@@ -0,0 +1,14 @@
+create table page_validators
+(
+    url           varchar                  not null,
+    etag          varchar,
+    last_modified varchar,
+    updated       timestamp with time zone not null
+);
+
+-- Same md5 index as the queue, the upsert in save_validators relies on it.
+create unique index page_validators_url_md5_uindex
+    on page_validators (md5(url));
+
+alter table page_validators
+    owner to root;
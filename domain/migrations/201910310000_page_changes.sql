@@ -0,0 +1,16 @@
+create table page_changes
+(
+    url          varchar                  not null,
+    content_hash varchar,
+    checks       real                     not null,
+    changes      real                     not null,
+    elapsed      real                     not null,
+    fetched      timestamp with time zone not null,
+    changed      timestamp with time zone not null
+);
+
+create unique index page_changes_url_md5_uindex
+    on page_changes (md5(url));
+
+alter table page_changes
+    owner to root;
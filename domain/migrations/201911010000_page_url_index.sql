@@ -0,0 +1,22 @@
+-- Point links at the oldest row of each URL and drop the duplicates so the unique index can be created.
+update page_x_page
+set found_on_page_id = d.keep_id
+from (select id, min(id) over (partition by url) as keep_id from page) d
+where page_x_page.found_on_page_id = d.id
+  and d.id <> d.keep_id;
+
+update page_x_page
+set page_id = d.keep_id
+from (select id, min(id) over (partition by url) as keep_id from page) d
+where page_x_page.page_id = d.id
+  and d.id <> d.keep_id;
+
+delete from page a
+    using page b
+where md5(a.url) = md5(b.url)
+  and a.url = b.url
+  and a.id > b.id;
+
+-- upsert_page_records relies on it, concurrent results consumers insert the same links.
+create unique index page_url_md5_uindex
+    on page (md5(url));
@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from core.cool_carbine_http import AioHTTPWorker
+from domain import SessionPair
+
+PAGE = b'<html><body><a href="/a">a</a></body></html>'
+
+
+async def page(request):
+    return web.Response(body=PAGE, content_type='text/html')
+
+
+async def declared_too_large(request):
+    return web.Response(body=b'x' * 2000, content_type='text/html')
+
+
+async def streamed_too_large(request):
+    # Chunked without a Content-Length, only the streaming cap can stop it.
+    response = web.StreamResponse(headers={'Content-Type': 'text/html'})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    for _ in range(10):
+        await response.write(b'x' * 500)
+    await response.write_eof()
+    return response
+
+
+async def pdf(request):
+    return web.Response(body=b'%PDF-1.4', content_type='application/pdf')
+
+
+async def not_modified(request):
+    return web.Response(status=304)
+
+
+class TestAioHTTPWorker(unittest.TestCase):
+    def fetch(self, path: str):
+        app = web.Application()
+        app.router.add_get('/page', page)
+        app.router.add_get('/declared', declared_too_large)
+        app.router.add_get('/streamed', streamed_too_large)
+        app.router.add_get('/pdf', pdf)
+        app.router.add_get('/not-modified', not_modified)
+        worker = AioHTTPWorker(None, None, {'max_body_size': 1000, 'chunk_size': 100}, 0)
+
+        async def fetch():
+            async with TestServer(app) as server:
+                async with aiohttp.ClientSession() as session:
+                    return await worker.fetch_url(SessionPair(session, str(server.make_url(path))))
+
+        return asyncio.run(fetch())
+
+    def test_read_body(self):
+        result = self.fetch('/page')
+
+        self.assertEqual(200, result.client_response.status)
+        self.assertEqual(PAGE, result.response_bytes)
+
+    def test_skip_declared_too_large(self):
+        result = self.fetch('/declared')
+
+        self.assertEqual(200, result.client_response.status)
+        self.assertFalse(result.has_body())
+
+    def test_abort_streamed_too_large(self):
+        result = self.fetch('/streamed')
+
+        self.assertEqual(200, result.client_response.status)
+        self.assertFalse(result.has_body())
+
+    def test_skip_content_type(self):
+        result = self.fetch('/pdf')
+
+        self.assertEqual('application/pdf', result.client_response.content_type)
+        self.assertFalse(result.has_body())
+
+    def test_not_modified(self):
+        result = self.fetch('/not-modified')
+
+        self.assertEqual(304, result.client_response.status)
+        self.assertFalse(result.has_body())
@@ -0,0 +1,98 @@
+import asyncio
+import socket
+import unittest
+from typing import List, Tuple
+
+from core.dns import CachingResolver
+
+
+class FakeResolver(CachingResolver):
+    def __init__(self, answers, **kwargs):
+        super().__init__(**kwargs)
+        self.answers = answers
+        self.queries: List[str] = []
+
+    async def _query(self, host: str, family: int) -> Tuple[List[str], float]:
+        self.queries.append(host)
+        await asyncio.sleep(0)
+        answer = self.answers[host]
+        if isinstance(answer, Exception):
+            raise answer
+
+        return answer
+
+
+class TestCachingResolver(unittest.TestCase):
+    def test_resolve_cached(self):
+        resolver = FakeResolver({'www.vg.no': (['195.88.54.16'], 300)})
+
+        async def resolve_twice():
+            hosts = await resolver.resolve('www.vg.no', 443, socket.AF_INET)
+            await resolver.resolve('www.vg.no', 443, socket.AF_INET)
+            return hosts
+
+        hosts = asyncio.run(resolve_twice())
+
+        self.assertEqual('195.88.54.16', hosts[0]['host'])
+        self.assertEqual(443, hosts[0]['port'])
+        self.assertEqual(['www.vg.no'], resolver.queries)
+
+    def test_concurrent_lookups_share_query(self):
+        resolver = FakeResolver({'www.vg.no': (['195.88.54.16'], 300)})
+
+        async def resolve_concurrently():
+            await asyncio.gather(*[resolver.resolve('www.vg.no') for _ in range(5)])
+
+        asyncio.run(resolve_concurrently())
+
+        self.assertEqual(['www.vg.no'], resolver.queries)
+
+    def test_not_found_cached(self):
+        resolver = FakeResolver({'nope.vg.no': Exception(4, 'Domain name not found')})
+
+        for _ in range(2):
+            with self.assertRaises(OSError):
+                asyncio.run(resolver.resolve('nope.vg.no'))
+
+        self.assertEqual(['nope.vg.no'], resolver.queries)
+
+    def test_ttl_expires(self):
+        resolver = FakeResolver({'www.vg.no': (['195.88.54.16'], 0)}, min_ttl=0)
+
+        asyncio.run(resolver.resolve('www.vg.no'))
+        asyncio.run(resolver.resolve('www.vg.no'))
+
+        self.assertEqual(['www.vg.no', 'www.vg.no'], resolver.queries)
+
+    def test_mark_unreachable(self):
+        resolver = FakeResolver({'www.vg.no': (['195.88.54.16'], 300)})
+        asyncio.run(resolver.resolve('www.vg.no'))
+
+        resolver.mark_unreachable('www.vg.no')
+
+        with self.assertRaises(OSError):
+            asyncio.run(resolver.resolve('www.vg.no'))
+
+    def test_prefetch(self):
+        resolver = FakeResolver({'www.vg.no': (['195.88.54.16'], 300), 'www.nrk.no': (['160.68.205.231'], 300)})
+
+        async def prefetch_then_resolve():
+            resolver.prefetch(['www.vg.no', 'www.nrk.no', 'www.vg.no'])
+            await asyncio.sleep(0.01)
+            await resolver.resolve('www.nrk.no')
+
+        asyncio.run(prefetch_then_resolve())
+
+        self.assertEqual(['www.nrk.no', 'www.vg.no'], sorted(resolver.queries))
+
+    def test_prefetch_queues_past_concurrency(self):
+        answers = {f'www{x}.vg.no': (['195.88.54.16'], 300) for x in range(5)}
+        resolver = FakeResolver(answers, prefetch_concurrency=2)
+
+        async def prefetch():
+            resolver.prefetch(answers.keys())
+            await asyncio.sleep(0.01)
+
+        asyncio.run(prefetch())
+
+        self.assertEqual(sorted(answers), sorted(resolver.queries))
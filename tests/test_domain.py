@@ -0,0 +1,68 @@
+import unittest
+
+from domain import SessionPairResultsDto, HttpClientResponseDto, SessionPair
+
+
+class TestSessionPairResultsDto(unittest.TestCase):
+    def test_wire_round_trip(self):
+        client_response = HttpClientResponseDto()
+        client_response.status = 200
+        client_response.reason = 'OK'
+        client_response.content_type = 'text/html'
+        client_response.charset = None
+        client_response.redirected = True
+        client_response.headers = {'ETag': '"abc"'}
+        results = SessionPairResultsDto(SessionPair(None, 'https://www.vg.no/æøå'), client_response, '<a href="/">blåbær</a>')
+
+        decoded = SessionPairResultsDto.from_bytes(results.to_bytes())
+
+        self.assertEqual(results.url, decoded.url)
+        self.assertEqual(results.response_body, decoded.response_body)
+        self.assertEqual(200, decoded.client_response.status)
+        self.assertEqual('OK', decoded.client_response.reason)
+        self.assertEqual('text/html', decoded.client_response.content_type)
+        self.assertIsNone(decoded.client_response.charset)
+        self.assertTrue(decoded.client_response.redirected)
+        self.assertEqual({'ETag': '"abc"'}, decoded.client_response.headers)
+
+    def test_wire_no_response(self):
+        results = SessionPairResultsDto(SessionPair(None, 'https://www.vg.no/'), None, None)
+
+        decoded = SessionPairResultsDto.from_bytes(results.to_bytes())
+
+        self.assertEqual('https://www.vg.no/', decoded.url)
+        self.assertIsNone(decoded.client_response)
+        self.assertIsNone(decoded.response_body)
+
+    def test_wire_raw_body(self):
+        client_response = HttpClientResponseDto()
+        client_response.status = 200
+        client_response.charset = 'iso-8859-1'
+        results = SessionPairResultsDto(SessionPair(None, 'https://www.vg.no/'), client_response, 'blåbær'.encode('iso-8859-1'))
+
+        decoded = SessionPairResultsDto.from_bytes(results.to_bytes())
+
+        self.assertEqual('blåbær'.encode('iso-8859-1'), decoded.response_bytes)
+        self.assertEqual('blåbær', decoded.response_body)
+
+    def test_undecodable_body(self):
+        client_response = HttpClientResponseDto()
+        client_response.charset = 'utf-8'
+        results = SessionPairResultsDto(SessionPair(None, 'https://www.vg.no/'), client_response, b'\xff\xfe\xfa')
+
+        self.assertIsNone(results.response_body)
+
+    def test_wire_extracted_urls(self):
+        results = SessionPairResultsDto(SessionPair(None, 'https://www.vg.no/'), HttpClientResponseDto(), b'<a href="/a">')
+        results.extracted_urls = ['https://www.vg.no/a', 'https://www.vg.no/b']
+
+        decoded = SessionPairResultsDto.from_bytes(results.to_bytes())
+
+        self.assertEqual(['https://www.vg.no/a', 'https://www.vg.no/b'], decoded.extracted_urls)
+        self.assertIsNone(SessionPairResultsDto.from_bytes(SessionPairResultsDto(None, None, None).to_bytes()).extracted_urls)
+
+    def test_str_does_not_decode(self):
+        results = SessionPairResultsDto(SessionPair(None, 'https://www.vg.no/'), HttpClientResponseDto(), 'blåbær'.encode('iso-8859-1'))
+
+        self.assertIn('<6/REDACTED>', str(results))
+        self.assertIsNone(results._response_text)
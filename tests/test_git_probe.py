@@ -0,0 +1,31 @@
+import datetime
+import unittest
+
+from core.git_probe import ProbeRegistry
+
+
+class TestProbeRegistry(unittest.TestCase):
+    def test_due_until_probed(self):
+        registry = ProbeRegistry(datetime.timedelta(days=30))
+        now = datetime.datetime(2019, 10, 29, tzinfo=datetime.timezone.utc)
+
+        self.assertEqual(['www.vg.no', 'www.nrk.no'], registry.due(['www.vg.no', 'www.nrk.no'], now))
+
+        registry.load('www.vg.no', now)
+        self.assertEqual(['www.nrk.no'], registry.due(['www.vg.no', 'www.nrk.no'], now))
+
+    def test_due_after_ttl(self):
+        registry = ProbeRegistry(datetime.timedelta(days=30))
+        now = datetime.datetime(2019, 10, 29, tzinfo=datetime.timezone.utc)
+        registry.load('www.vg.no', now)
+
+        self.assertFalse(registry.is_due('www.vg.no', now + datetime.timedelta(days=29)))
+        self.assertTrue(registry.is_due('www.vg.no', now + datetime.timedelta(days=30)))
+
+    def test_load_keeps_latest(self):
+        registry = ProbeRegistry(datetime.timedelta(days=30))
+        now = datetime.datetime(2019, 10, 29, tzinfo=datetime.timezone.utc)
+        registry.load('www.vg.no', now)
+        registry.load('www.vg.no', now - datetime.timedelta(days=60))
+
+        self.assertFalse(registry.is_due('www.vg.no', now))
@@ -0,0 +1,73 @@
+import unittest
+
+from core.host_health import HostHealth
+
+
+class TestHostHealth(unittest.TestCase):
+    def test_additive_increase(self):
+        health = HostHealth(initial_concurrency=1, max_concurrency=4)
+
+        for i in range(10):
+            health.record_success('www.vg.no', 0.1, now=100.0 + i)
+
+        self.assertEqual(4, health.limit('www.vg.no'))
+
+    def test_multiplicative_decrease(self):
+        health = HostHealth(initial_concurrency=4, max_concurrency=4, failure_threshold=10)
+
+        health.record_failure('www.vg.no', now=100.0)
+
+        self.assertEqual(2, health.limit('www.vg.no'))
+
+    def test_slow_host_decreases(self):
+        health = HostHealth(initial_concurrency=4, max_concurrency=4, target_latency=1.0)
+
+        health.record_success('www.vg.no', 5.0, now=100.0)
+
+        self.assertEqual(2, health.limit('www.vg.no'))
+
+    def test_circuit_opens_and_closes(self):
+        health = HostHealth(failure_threshold=3, backoff=60)
+        for i in range(3):
+            health.record_failure('www.vg.no', now=100.0 + i)
+
+        self.assertTrue(health.is_open('www.vg.no', now=103.0))
+        self.assertFalse(health.is_open('www.vg.no', now=163.0))
+        self.assertEqual(1, health.limit('www.vg.no'))
+
+        health.record_success('www.vg.no', 0.1, now=163.0)
+        self.assertFalse(health.is_open('www.vg.no', now=163.0))
+
+    def test_backoff_doubles(self):
+        health = HostHealth(failure_threshold=1, backoff=60, max_backoff=200)
+        health.record_failure('www.vg.no', now=100.0)
+        health.record_failure('www.vg.no', now=100.0)
+        self.assertTrue(health.is_open('www.vg.no', now=219.0))
+
+        health.record_failure('www.vg.no', now=100.0)
+        self.assertTrue(health.is_open('www.vg.no', now=299.0))
+        self.assertFalse(health.is_open('www.vg.no', now=300.0))
+
+    def test_park(self):
+        health = HostHealth(failure_threshold=1, park_threshold=3, park_duration=86400)
+        for _ in range(4):
+            health.record_failure('www.vg.no', now=100.0)
+
+        self.assertEqual([('www.vg.no', 86400)], health.take_parked())
+        self.assertEqual([], health.take_parked())
+
+    def test_defer(self):
+        health = HostHealth(failure_threshold=1, backoff=60)
+        health.record_failure('www.vg.no', now=100.0)
+        health.defer('https://www.vg.no/', 'www.vg.no', now=130.0)
+
+        self.assertEqual([('https://www.vg.no/', 30.0)], health.take_deferred())
+
+    def test_prune(self):
+        health = HostHealth()
+        health.record_success('www.vg.no', 0.1, now=100.0)
+
+        health.prune(3600, now=200.0)
+        self.assertEqual(1, len(health))
+        health.prune(3600, now=4000.0)
+        self.assertEqual(0, len(health))
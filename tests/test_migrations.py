@@ -0,0 +1,21 @@
+import unittest
+
+from core.migrations import list_migrations
+
+
+class TestMigrations(unittest.TestCase):
+    def test_list_migrations_ordered(self):
+        names = [name for name, _ in list_migrations()]
+
+        self.assertEqual(sorted(names), names)
+        self.assertIn('201910270000_queue_indexes', names)
+
+    def test_list_migrations_sql(self):
+        migrations = dict(list_migrations())
+
+        self.assertIn('create unique index queue_url_md5_uindex', migrations['201910270000_queue_indexes'])
+
+    def test_page_url_index(self):
+        migrations = dict(list_migrations())
+
+        self.assertIn('create unique index page_url_md5_uindex', migrations['201911010000_page_url_index'])
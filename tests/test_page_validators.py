@@ -0,0 +1,29 @@
+import unittest
+
+from core.page_validators import ValidatorCache
+
+
+class TestValidatorCache(unittest.TestCase):
+    def test_take_headers(self):
+        cache = ValidatorCache(10)
+        cache.put('https://www.vg.no/', '"abc"', 'Tue, 29 Oct 2019 10:00:00 GMT')
+
+        self.assertEqual(
+            {'If-None-Match': '"abc"', 'If-Modified-Since': 'Tue, 29 Oct 2019 10:00:00 GMT'},
+            cache.take_headers('https://www.vg.no/')
+        )
+        self.assertEqual({}, cache.take_headers('https://www.vg.no/'))
+
+    def test_etag_only(self):
+        cache = ValidatorCache(10)
+        cache.put('https://www.vg.no/', '"abc"', None)
+
+        self.assertEqual({'If-None-Match': '"abc"'}, cache.take_headers('https://www.vg.no/'))
+
+    def test_bounded(self):
+        cache = ValidatorCache(2)
+        for i in range(3):
+            cache.put(f'https://www.vg.no/{i}', f'"{i}"', None)
+
+        self.assertEqual(2, len(cache))
+        self.assertEqual({}, cache.take_headers('https://www.vg.no/0'))
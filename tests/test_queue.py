@@ -1,6 +1,10 @@
+import datetime
 import unittest
 
 from core.database import get_connection
+from core.queue import HostScheduler, SeenSet
+from core.url_parse import CCUrl
+from domain import QueueObject
 from tests import async_test
 
 
@@ -17,3 +21,70 @@ class TestQueue(unittest.TestCase):
         for v in values:
             latest_schedule[v.get('netloc')] = v.get('scheduled')
         await connection.close()
+
+
+class TestHostScheduler(unittest.TestCase):
+    def test_slots_spacing(self):
+        scheduler = HostScheduler(max_hourly_visits=10, spacing=datetime.timedelta(minutes=6))
+        now = datetime.datetime(2019, 10, 26, tzinfo=datetime.timezone.utc)
+
+        self.assertEqual(
+            [now, now + datetime.timedelta(minutes=6)],
+            scheduler.slots(now + datetime.timedelta(minutes=12), 2)
+        )
+
+    def test_take_states(self):
+        scheduler = HostScheduler(max_hourly_visits=2)
+        now = datetime.datetime(2019, 10, 26, tzinfo=datetime.timezone.utc)
+        scheduler.load('vg.no', 0.5, now - datetime.timedelta(minutes=30))
+
+        self.assertIsNone(scheduler.try_acquire('vg.no', now))
+        self.assertIsNone(scheduler.try_acquire('nrk.no', now))
+
+        states = dict(scheduler.take_states())
+        self.assertAlmostEqual(0.5, states['vg.no'].tokens)
+        self.assertAlmostEqual(1, states['nrk.no'].tokens)
+        self.assertEqual([], scheduler.take_states())
+
+    def test_pop_ready_max_hourly_visits(self):
+        scheduler = HostScheduler(max_hourly_visits=2)
+        now = datetime.datetime(2019, 10, 26, tzinfo=datetime.timezone.utc)
+
+        for x in range(4):
+            scheduler.push(QueueObject(x, f'https://vg.no/{x}', now, 'vg.no'), now)
+        scheduler.push(QueueObject(4, 'https://nrk.no/', now, 'nrk.no'), now)
+
+        ready, deferred = scheduler.pop_ready(10, now)
+
+        self.assertEqual(3, len(ready))
+        self.assertEqual(2, len(deferred))
+        self.assertEqual(0, len(scheduler))
+        self.assertEqual(
+            [now + datetime.timedelta(minutes=30), now + datetime.timedelta(minutes=60)],
+            sorted(available for _, available in deferred)
+        )
+
+    def test_pop_ready_not_due(self):
+        scheduler = HostScheduler()
+        now = datetime.datetime(2019, 10, 26, tzinfo=datetime.timezone.utc)
+        scheduler.push(QueueObject(1, 'https://vg.no/', now, 'vg.no'), now + datetime.timedelta(minutes=1))
+
+        ready, deferred = scheduler.pop_ready(10, now)
+
+        self.assertEqual([], ready)
+        self.assertEqual(1, len(scheduler))
+
+
+class TestSeenSet(unittest.TestCase):
+    def test_filter_and_evict(self):
+        seen = SeenSet(2)
+        seen.add([CCUrl('https://a.no/'), CCUrl('https://b.no/')])
+
+        unseen = seen.filter([CCUrl('https://a.no/'), CCUrl('https://c.no/')])
+        self.assertEqual(['https://c.no/'], [url.url for url in unseen])
+
+        # a was refreshed by the filter call so b is the oldest.
+        seen.add(unseen)
+        self.assertIn('https://a.no/', seen)
+        self.assertNotIn('https://b.no/', seen)
+        self.assertEqual(2, len(seen))
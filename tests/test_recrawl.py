@@ -0,0 +1,49 @@
+import datetime
+import unittest
+
+from core.recrawl import estimate_change_rate, next_interval, update_changes
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+class TestRecrawl(unittest.TestCase):
+    def test_estimate_change_rate(self):
+        self.assertIsNone(estimate_change_rate(0, 0, 0))
+        self.assertEqual(0, estimate_change_rate(10, 0, 10 * DAY))
+        # Changed on every check, faster than once between checks.
+        self.assertGreater(estimate_change_rate(10, 10, 10 * DAY), 1 / DAY)
+
+    def test_next_interval(self):
+        self.assertEqual(DAY, next_interval(0, 0, 0, HOUR, 30 * DAY, DAY))
+        self.assertEqual(HOUR, next_interval(10, 10, 10 * HOUR, HOUR, 30 * DAY, DAY))
+        self.assertEqual(2 * DAY, next_interval(3, 0, 3 * DAY, HOUR, 30 * DAY, DAY))
+        self.assertEqual(30 * DAY, next_interval(3, 0, 300 * DAY, HOUR, 30 * DAY, DAY))
+
+    def test_front_page_before_static_page(self):
+        front = next_interval(10, 9, 10 * DAY, HOUR, 30 * DAY, DAY)
+        static = next_interval(10, 1, 10 * DAY, HOUR, 30 * DAY, DAY)
+
+        self.assertLess(front, static)
+
+    def test_update_changes(self):
+        fetched = datetime.datetime(2019, 10, 31, tzinfo=datetime.timezone.utc)
+        changes = update_changes(None, 'https://www.vg.no/', 'a', fetched, 20)
+        self.assertEqual((0, 0, 0), (changes.checks, changes.changes, changes.elapsed))
+
+        changes = update_changes(changes, 'https://www.vg.no/', 'b', fetched + datetime.timedelta(hours=1), 20)
+        self.assertEqual((1, 1, HOUR), (changes.checks, changes.changes, changes.elapsed))
+        self.assertEqual(fetched + datetime.timedelta(hours=1), changes.changed)
+
+        # A 304 has no hash and counts as unchanged.
+        changes = update_changes(changes, 'https://www.vg.no/', None, fetched + datetime.timedelta(hours=2), 20)
+        self.assertEqual((2, 1, 2 * HOUR), (changes.checks, changes.changes, changes.elapsed))
+        self.assertEqual('b', changes.content_hash)
+
+    def test_update_changes_history(self):
+        fetched = datetime.datetime(2019, 10, 31, tzinfo=datetime.timezone.utc)
+        changes = update_changes(None, 'https://www.vg.no/', 'a', fetched, 2)
+        for hours in range(1, 4):
+            changes = update_changes(changes, 'https://www.vg.no/', 'a', fetched + datetime.timedelta(hours=hours), 2)
+
+        self.assertEqual(2, changes.checks)
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code: str) -> str:
+    return subprocess.check_output([sys.executable, '-c', code], cwd=ROOT).decode().strip()
+
+
+class TestStartup(unittest.TestCase):
+    def test_url_parse_import_is_lazy(self):
+        loaded = run_python(
+            'import sys, core.url_parse; '
+            'print(" ".join(m for m in ("django", "validators", "bs4") if m in sys.modules))'
+        )
+
+        self.assertEqual('', loaded)
+
+    def test_django_not_loaded_for_unambiguous_urls(self):
+        loaded = run_python(
+            'import sys, core.url_parse; '
+            'core.url_parse.is_valid_url("https://www.vg.no/"); '
+            'core.url_parse.is_valid_url("javascript:void(0)"); '
+            'print("django" in sys.modules)'
+        )
+
+        self.assertEqual('False', loaded)
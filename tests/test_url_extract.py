@@ -0,0 +1,32 @@
+import os
+import unittest
+
+from core.url_extract import extract_hrefs_tokenizer, extract_hrefs_bs4
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data', 'html')
+
+
+class TestUrlExtract(unittest.TestCase):
+    def test_tokenizer_matches_bs4(self):
+        for file_name in sorted(os.listdir(TEST_DATA)):
+            with open(os.path.join(TEST_DATA, file_name), 'r') as fd:
+                body = fd.read()
+
+            self.assertEqual(extract_hrefs_bs4(body), extract_hrefs_tokenizer(body), file_name)
+
+        # Unclosed comments, scripts and tags run to the end of the document.
+        for body in ['x<!--' * 100 + '<a href=/ok>', '<script>' * 100 + '<a href=/ok>', '<style><a href=/ok>', '<a ' * 100, '<a \'' * 100, '<a href=/x <a href=/y']:
+            self.assertEqual(extract_hrefs_bs4(body), extract_hrefs_tokenizer(body), body[:20])
+
+    def test_tokenizer_skips_comments_and_scripts(self):
+        body = '<!-- <a href="/comment"> --><script>var a = "<a href=/script>";</script><a href="/page">'
+
+        self.assertEqual((None, ['/page']), extract_hrefs_tokenizer(body))
+
+    def test_tokenizer_attributes(self):
+        body = '<base href="https://www.vg.no/a/"><a title="href=/title" HREF=\'/x?a=1&amp;b=2\'><a hreflang="no"><a href>'
+
+        self.assertEqual(
+            ('https://www.vg.no/a/', ['/x?a=1&b=2', None, '']),
+            extract_hrefs_tokenizer(body)
+        )
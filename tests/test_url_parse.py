@@ -5,7 +5,7 @@ from queue import Queue
 from cool_carbine import results_worker_wrapper, results_worker
 from domain.http_consts import ContentTypes
 from core.url_extract import UrlExtract, extract_urls
-from core.url_parse import CCUrl, filter_url, parse_extracted_url, parse_extracted_url_list
+from core.url_parse import CCUrl, filter_url, parse_extracted_url, parse_extracted_url_list, canonicalize_url, canonicalize_urls
 from domain import SessionPair, SessionPairResultsDto, HttpClientResponseDto
 from tests import async_test
 
@@ -83,6 +83,44 @@ class TestUrlParse(unittest.TestCase):
 
         self.assertEqual(expected_value, actual_value)
 
+    def test_parse_extracted_url_list_matches_single(self):
+        base_url = CCUrl('https://www.aftenbladet.no/a/b')
+        hrefs = ['//www.vg.no/x', ' ./a ', '../b', '/c', 'https://nrk.no/d', None, '#e']
+
+        expected_value = [parse_extracted_url(base_url, href).url for href in hrefs if filter_url(href)]
+        actual_value = [url.url for url in parse_extracted_url_list(base_url, hrefs, 0)]
+
+        self.assertEqual([url for url in expected_value if CCUrl(url).netloc.endswith('.no')], actual_value)
+
+    def test_parse_extracted_url_list_skips_invalid(self):
+        base_url = CCUrl('https://www.aftenbladet.no/a/b')
+
+        actual_value = [url.url for url in parse_extracted_url_list(base_url, ['https://[foo.no/x', '//[foo.no/y', '/c'], 0)]
+
+        self.assertEqual(['https://www.aftenbladet.no/c'], actual_value)
+
+    def test_ccurl_lazy(self):
+        url = CCUrl('//www.vg.no/a?b=c')
+        self.assertFalse(hasattr(url, '__dict__'))
+        self.assertEqual('www.vg.no', url.netloc)
+
+        url.set_scheme('https')
+        self.assertEqual('https://www.vg.no/a?b=c', url.url)
+        self.assertEqual('https', url.scheme)
+        self.assertEqual('www.vg.no', url.urlparse.netloc)
+
+    def test_canonicalize_url(self):
+        self.assertEqual('https://www.vg.no/?a=1&b=2', canonicalize_url('HTTPS://WWW.VG.NO:443?b=2&a=1#top'))
+        self.assertEqual('http://vg.no/a/', canonicalize_url('http://vg.no:80/a/'))
+        self.assertEqual('http://vg.no:8080/A', canonicalize_url('http://vg.no:8080/A'))
+        self.assertEqual('http://[::1]/x', canonicalize_url('http://[::1]:80/x'))
+        self.assertEqual('https://vg.no/a?a&x=%20', canonicalize_url('https://vg.no/a?x=%20&a'))
+
+    def test_canonicalize_urls_dedupe(self):
+        urls = [CCUrl('https://www.vg.no/#a'), CCUrl('https://www.vg.no/'), CCUrl('https://WWW.vg.no')]
+
+        self.assertEqual(['https://www.vg.no/'], [url.url for url in canonicalize_urls(urls)])
+
     async def get_extracted_urls(self, file_name: str):
         session_pair_results = await self.get_session_pair_results(file_name)
 
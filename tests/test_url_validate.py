@@ -0,0 +1,36 @@
+import os
+import unittest
+
+from core.url_extract import extract_hrefs_tokenizer
+from core.url_parse import CCUrl, is_valid_url, filter_url, parse_extracted_url
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+
+
+def legacy_is_valid(url: CCUrl) -> bool:
+    votes = [url._url_validator_regex_001(), url._url_validator_django(), url._url_validator_validators()]
+    return sum(votes) >= 2
+
+
+class TestUrlValidate(unittest.TestCase):
+    def get_corpus(self):
+        with open(os.path.join(TEST_DATA, 'urls.txt'), 'r') as fd:
+            corpus = [line.rstrip('\n') for line in fd if line.strip()]
+
+        base = CCUrl('https://www.aftenbladet.no/')
+        html_directory = os.path.join(TEST_DATA, 'html')
+        for file_name in sorted(os.listdir(html_directory)):
+            with open(os.path.join(html_directory, file_name), 'r') as fd:
+                _, hrefs = extract_hrefs_tokenizer(fd.read())
+            corpus += [parse_extracted_url(base, href).url for href in hrefs if filter_url(href)]
+
+        return corpus
+
+    def test_same_verdict_as_vote(self):
+        for url in self.get_corpus():
+            self.assertEqual(legacy_is_valid(CCUrl(url)), is_valid_url(url), url)
+
+    def test_verdicts(self):
+        self.assertTrue(is_valid_url('https://www.vg.no/'))
+        self.assertFalse(is_valid_url('javascript:void(0)'))
+        self.assertFalse(is_valid_url("https://test.com/{{'global.menu.external.protectMyChoicesLink' | translate}}"))
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from core.visited import BloomFilter, is_fetched
+from domain import SessionPairResultsDto, HttpClientResponseDto
+
+
+class TestVisited(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'visited.bloom')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_add_contains(self):
+        visited = BloomFilter(self.path, 1000, 0.01)
+        visited.add('https://www.vg.no/')
+
+        self.assertIn('https://www.vg.no/', visited)
+        self.assertNotIn('https://www.nrk.no/', visited)
+        visited.close()
+
+    def test_shared_between_instances(self):
+        writer = BloomFilter(self.path, 1000, 0.01)
+        reader = BloomFilter(self.path, 1000, 0.01)
+
+        writer.add('https://www.vg.no/')
+        self.assertIn('https://www.vg.no/', reader)
+
+        writer.close()
+        reader.close()
+
+        reopened = BloomFilter(self.path, 1000, 0.01)
+        self.assertIn('https://www.vg.no/', reopened)
+        reopened.close()
+
+    def test_size_mismatch(self):
+        BloomFilter(self.path, 1000, 0.01).close()
+
+        with self.assertRaises(ValueError):
+            BloomFilter(self.path, 100000, 0.01)
+
+    def test_false_positive_rate(self):
+        visited = BloomFilter(self.path, 10000, 0.01)
+        for x in range(10000):
+            visited.add(f'https://www.vg.no/{x}')
+
+        false_positives = sum(1 for x in range(10000) if f'https://www.nrk.no/{x}' in visited)
+        self.assertLess(false_positives, 200)
+        visited.close()
+
+    def test_is_fetched(self):
+        def results(status):
+            client_response = None
+            if status is not None:
+                client_response = HttpClientResponseDto()
+                client_response.status = status
+            return SessionPairResultsDto(None, client_response, None)
+
+        self.assertTrue(is_fetched(results(200)))
+        self.assertTrue(is_fetched(results(404)))
+        self.assertFalse(is_fetched(results(None)))
+        self.assertFalse(is_fetched(results(503)))
+        self.assertFalse(is_fetched(results(429)))